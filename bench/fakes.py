@@ -0,0 +1,192 @@
+import asyncio
+import itertools
+import random
+import time
+import discord
+
+# Stand-ins for the parts of discord.py that AnonPost touches. Every REST call
+# goes through FakeHTTP, which adds latency and enforces Discord's per-channel
+# message limit the way the library does: by sleeping until the bucket resets.
+
+_snowflakes = itertools.count(1_000_000_000_000)
+
+
+def snowflake():
+    return next(_snowflakes)
+
+
+class FakeHTTP:
+    def __init__(self, latency=0.03, jitter=0.01, rate=5, per=5.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate = rate
+        self.per = per
+        self.requests = 0
+        self.rate_limited = 0
+        self._windows = {}
+
+    async def request(self, bucket):
+        self.requests += 1
+        now = time.monotonic()
+        window = self._windows.get(bucket)
+        if window is None or now >= window[0]:
+            window = self._windows[bucket] = [now + self.per, 0]
+        if window[1] >= self.rate:
+            # a 429 the library would retry after sleeping out the bucket
+            self.rate_limited += 1
+            await asyncio.sleep(window[0] - now)
+            return await self.request(bucket)
+        window[1] += 1
+        await asyncio.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+
+
+class FakeAsset:
+    url = 'https://cdn.discordapp.com/embed/avatars/0.png'
+
+
+class FakeUser:
+    def __init__(self, user_id):
+        self.id = user_id
+        self.avatar = FakeAsset()
+
+
+class FakeThread:
+    def __init__(self, http, thread_id, parent):
+        self.http = http
+        self.id = thread_id
+        self.parent = parent
+        self.messages = 0
+
+    async def send(self, embed=None, files=None, **kwargs):
+        await self.http.request(self.id)
+        self.messages += 1
+        return FakeMessage(self.http, snowflake(), self)
+
+
+class FakeMessage:
+    def __init__(self, http, message_id, channel):
+        self.http = http
+        self.id = message_id
+        self.channel = channel
+        self.guild = getattr(channel, 'guild', None)
+        self.thread = None
+        self.post_id = None
+
+    async def create_thread(self, name, auto_archive_duration=60):
+        await self.http.request(self.channel.id)
+        if self.guild.get_thread(self.id) is not None:
+            raise discord.HTTPException(_FakeResponse(400), {'code': 160004, 'message': 'A thread has already been created for this message'})
+        thread = FakeThread(self.http, self.id, self.channel)
+        self.guild.threads[self.id] = thread
+        self.thread = thread
+        self.guild.threads_created += 1
+        return thread
+
+
+class _FakeResponse:
+    def __init__(self, status):
+        self.status = status
+        self.reason = 'Bad Request'
+
+
+class FakeChannel:
+    def __init__(self, http, guild, channel_id=None):
+        self.http = http
+        self.guild = guild
+        self.id = channel_id or snowflake()
+        self.messages = {}
+
+    async def send(self, embed=None, view=None, files=None, **kwargs):
+        await self.http.request(self.id)
+        message = FakeMessage(self.http, snowflake(), self)
+        message.post_id = next((item.post_id for item in view.children if hasattr(item, 'post_id')), None) if view else None
+        self.messages[message.id] = message
+        return message
+
+    def get_partial_message(self, message_id):
+        return self.messages.get(message_id) or FakeMessage(self.http, message_id, self)
+
+
+class FakeGuild:
+    def __init__(self, guild_id=None):
+        self.id = guild_id or snowflake()
+        self.threads = {}
+        self.threads_created = 0
+
+    def get_thread(self, thread_id):
+        return self.threads.get(thread_id)
+
+
+class FakeBot:
+    cluster_id = None
+
+    def __init__(self, http):
+        self.http = http
+        self.user = FakeUser(snowflake())
+        self.channels = {}
+        self.cogs = {}
+
+    def add_channel(self, channel):
+        self.channels[channel.id] = channel
+
+    def get_channel(self, channel_id):
+        return self.channels.get(channel_id)
+
+    def get_cog(self, name):
+        return self.cogs.get(name)
+
+    async def fetch_channel(self, channel_id):
+        await self.http.request('fetch_channel')
+        for channel in self.channels.values():
+            thread = channel.guild.get_thread(channel_id)
+            if thread is not None:
+                return thread
+        raise discord.NotFound(_FakeResponse(404), 'Unknown Channel')
+
+    def add_dynamic_items(self, *items):
+        pass
+
+    def remove_dynamic_items(self, *items):
+        pass
+
+
+class FakeResponse:
+    def __init__(self, interaction):
+        self.interaction = interaction
+        self.modal = None
+        self.messages = []
+
+    async def send_message(self, content=None, ephemeral=False, **kwargs):
+        await self.interaction.client.http.request(('interaction', self.interaction.id))
+        self.messages.append(content)
+
+    async def send_modal(self, modal):
+        await self.interaction.client.http.request(('interaction', self.interaction.id))
+        self.modal = modal
+
+
+class FakeFollowup:
+    def __init__(self, interaction):
+        self.interaction = interaction
+        self.messages = []
+
+    async def send(self, content=None, ephemeral=False, **kwargs):
+        await self.interaction.client.http.request(('webhook', self.interaction.id))
+        self.messages.append(content)
+        self.interaction.done.set()
+
+
+class FakeInteraction:
+    def __init__(self, bot, user_id, channel):
+        self.id = snowflake()
+        self.client = bot
+        self.user = FakeUser(user_id)
+        self.channel = channel
+        self.channel_id = channel.id
+        self.guild_id = channel.guild.id
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+        self.done = asyncio.Event()
+
+    def replies(self):
+        return self.response.messages + self.followup.messages
@@ -0,0 +1,267 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from io import BytesIO
+from aiohttp import web
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import commands.backend as backend
+from utils.metrics import metrics
+from bench.fakes import FakeBot, FakeChannel, FakeGuild, FakeHTTP, FakeInteraction
+
+# Offline load test for AnonPost. Drives the real cog, buttons and modals against
+# bench.fakes and a local image server, then reports throughput, latency and memory.
+#
+#   python -m bench.run
+#   python -m bench.run --scenario reply_storm --ops 200 --latency 50
+
+
+def _make_images(count):
+    images = []
+    rng = random.Random(1)
+    for i in range(count):
+        width, height = rng.choice([(640, 480), (1920, 1080), (3000, 2000)])
+        img = Image.new('RGB', (width, height), (rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+        img.paste(Image.effect_noise((width // 4, height // 4), 64).convert('RGB').resize((width, height)))
+        out = BytesIO()
+        img.save(out, 'JPEG' if i % 2 else 'PNG', quality=95)
+        images.append(out.getvalue())
+    return images
+
+
+class ImageServer:
+    def __init__(self, images):
+        self.images = images
+        self.requests = 0
+        self.runner = None
+        self.port = None
+
+    async def start(self):
+        async def handle(request):
+            self.requests += 1
+            data = self.images[int(request.match_info['n']) % len(self.images)]
+            return web.Response(body=data, content_type='image/png', headers={'ETag': f'"{request.match_info["n"]}"', 'Cache-Control': 'max-age=3600'})
+
+        app = web.Application()
+        app.router.add_get('/img/{n}.png', handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    def url(self, n):
+        return f'http://127.0.0.1:{self.port}/img/{n}.png'
+
+    async def close(self):
+        await self.runner.cleanup()
+
+
+class Harness:
+    def __init__(self, args):
+        self.args = args
+        self.users = iter(range(1, 10 ** 9))
+
+    async def __aenter__(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+        per = 5.0 * self.args.time_scale
+        self.http = FakeHTTP(latency=self.args.latency / 1000, jitter=self.args.latency / 3000, per=per)
+        self.bot = FakeBot(self.http)
+        self.cog = backend.AnonPost(self.bot)
+        self.bot.cogs['AnonPost'] = self.cog
+        await self.cog.cog_load()
+        self.cog.outbound.per = per
+        guild = FakeGuild()
+        self.channels = []
+        for _ in range(self.args.channels):
+            channel = FakeChannel(self.http, guild)
+            self.bot.add_channel(channel)
+            await self.cog.channels.add(channel.id)
+            await self.cog.channels.update(channel.id, cooldown=0, rate_limit=0, flood_limit=0)
+            self.channels.append(channel)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.cog.cog_unload()
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    async def post(self, channel, body, image_url=''):
+        user = next(self.users)
+        start = time.perf_counter()
+        click = FakeInteraction(self.bot, user, channel)
+        await self.cog.on_button(click)
+        modal = click.response.modal
+        if modal is None:
+            return time.perf_counter() - start, False
+        modal.title_input._value = 'bench'
+        modal.body_input._value = body
+        modal.image_input._value = image_url
+        submit = FakeInteraction(self.bot, user, channel)
+        await modal.on_submit(submit)
+        return time.perf_counter() - start, any(m and 'successfully' in m for m in submit.followup.messages)
+
+    async def reply(self, channel, post_id, body, image_url=''):
+        user = next(self.users)
+        start = time.perf_counter()
+        click = FakeInteraction(self.bot, user, channel)
+        await self.cog.on_button(click, post_id)
+        modal = click.response.modal
+        if modal is None:
+            return time.perf_counter() - start, False
+        modal.body_input._value = body
+        modal.image_input._value = image_url
+        submit = FakeInteraction(self.bot, user, channel)
+        await modal.on_submit(submit)
+        return time.perf_counter() - start, any(m and 'successfully' in m for m in submit.followup.messages)
+
+
+def _percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _report(name, results, elapsed, **extra):
+    latencies = [r[0] for r in results]
+    errors = sum(1 for r in results if not r[1])
+    return {
+        'scenario': name,
+        'ops': len(results),
+        'errors': errors,
+        'seconds': round(elapsed, 3),
+        'ops_per_sec': round(len(results) / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(_percentile(latencies, 0.50) * 1000, 1),
+        'p99_ms': round(_percentile(latencies, 0.99) * 1000, 1),
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        **extra,
+    }
+
+
+async def text_flood(args, server):
+    async with Harness(args) as h:
+        start = time.perf_counter()
+        results = await asyncio.gather(*(h.post(h.channels[i % len(h.channels)], f'flood post {i} ' * 20) for i in range(args.ops)))
+        return _report('text_flood', results, time.perf_counter() - start, rate_limited=h.http.rate_limited)
+
+
+async def image_posts(args, server):
+    async with Harness(args) as h:
+        before = server.requests
+        start = time.perf_counter()
+        # half of the posts reuse a small set of popular images
+        urls = [server.url(i % 8 if i % 2 else 1000 + i) for i in range(args.ops)]
+        results = await asyncio.gather(*(h.post(h.channels[i % len(h.channels)], f'image post {i}', urls[i]) for i in range(args.ops)))
+        return _report('image_posts', results, time.perf_counter() - start, downloads=server.requests - before,
+                       cache_hit_ratio=round(h.cog.images.hit_rate(), 3))
+
+
+async def reply_storm(args, server):
+    async with Harness(args) as h:
+        channel = h.channels[0]
+        _, ok = await h.post(channel, 'thread root')
+        if not ok:
+            raise RuntimeError('could not create the root post')
+        post_id = next(iter(channel.messages.values())).post_id
+        start = time.perf_counter()
+        results = await asyncio.gather(*(h.reply(channel, post_id, f'reply {i}') for i in range(args.ops)))
+        return _report('reply_storm', results, time.perf_counter() - start, threads_created=channel.guild.threads_created,
+                       rate_limited=h.http.rate_limited)
+
+
+async def raid(args, server):
+    async with Harness(args) as h:
+        channel = h.channels[0]
+        await h.cog.channels.update(channel.id, flood_limit=3)
+        start = time.perf_counter()
+        # many accounts posting one copypasta with small edits and the same image behind different URLs
+        results = await asyncio.gather(*(h.post(channel, f'join our server now {i % 3} ' + 'free nitro giveaway click the link ' * 10,
+                                                server.url(8 * i)) for i in range(args.ops)))
+        return _report('raid', results, time.perf_counter() - start, rejected=int(metrics.counters.get('flood_rejected', 0)),
+                       sent=len(channel.messages))
+
+
+async def ban_growth(args, server):
+    async with Harness(args) as h:
+        start = time.perf_counter()
+        for first in range(0, args.bans, 1000):
+            await asyncio.gather(*(h.cog._add_ban(10 ** 12 + n, time.time() + 86400) for n in range(first, min(args.bans, first + 1000))))
+        ban_seconds = time.perf_counter() - start
+
+        channel = h.channels[0]
+        results = []
+        start = time.perf_counter()
+        for _ in range(args.ops):
+            click = FakeInteraction(h.bot, next(h.users), channel)
+            click_start = time.perf_counter()
+            await h.cog.on_button(click)
+            results.append((time.perf_counter() - click_start, click.response.modal is not None))
+        return _report('ban_growth', results, time.perf_counter() - start, bans=args.bans,
+                       bans_per_sec=round(args.bans / ban_seconds, 1))
+
+
+SCENARIOS = {
+    'text_flood': text_flood,
+    'image_posts': image_posts,
+    'reply_storm': reply_storm,
+    'raid': raid,
+    'ban_growth': ban_growth,
+}
+
+
+async def _run_scenario(args):
+    server = ImageServer(_make_images(16))
+    await server.start()
+    try:
+        return await SCENARIOS[args.scenario[0]](args, server)
+    finally:
+        await server.close()
+
+
+def _run_isolated(args, name):
+    # ru_maxrss is a process-wide high-water mark, so each scenario gets its own
+    # process to report its own peak memory
+    command = [sys.executable, '-m', 'bench.run', '--scenario', name, '--json', '--ops', str(args.ops),
+               '--channels', str(args.channels), '--bans', str(args.bans), '--latency', str(args.latency),
+               '--time-scale', str(args.time_scale)]
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run(command, cwd=root, check=True, stdout=subprocess.PIPE).stdout
+    return json.loads(output)[0]
+
+
+def main(args):
+    names = args.scenario or list(SCENARIOS)
+    if len(names) == 1:
+        reports = [asyncio.run(_run_scenario(argparse.Namespace(**{**vars(args), 'scenario': names})))]
+    else:
+        reports = [_run_isolated(args, name) for name in names]
+
+    if args.json:
+        print(json.dumps(reports, indent=2))
+        return
+    for report in reports:
+        print(f'{report.pop("scenario"):<12} ' + ' '.join(f'{key}={value}' for key, value in report.items()))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Offline AnonPost load test')
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS), help='run only this scenario (repeatable); each runs in its own process')
+    parser.add_argument('--ops', type=int, default=200, help='posts, replies or clicks per scenario')
+    parser.add_argument('--channels', type=int, default=20, help='anonymous channels to spread posts over')
+    parser.add_argument('--bans', type=int, default=50000, help='bans to add in the ban_growth scenario')
+    parser.add_argument('--latency', type=float, default=30, help='simulated Discord REST latency in ms')
+    parser.add_argument('--time-scale', type=float, default=0.02, help='shrinks the 5 per 5s channel rate limit window')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    main(parser.parse_args())
@@ -1,37 +1,81 @@
 import discord
 from discord.ext import commands
+import hashlib
+import json
 import os
 
 TOKEN = ''
+SHARDED = False  # run an AutoShardedBot; launcher.py always does
+SHARD_COUNT = None  # None lets Discord recommend a shard count
+# 429s that would sleep longer than this raise discord.RateLimited instead, so the
+# send queues can back off; discord.py does not accept anything below 30 seconds
+MAX_RATELIMIT_TIMEOUT = 30.0
+COMMAND_HASH_FILE = os.path.join(os.path.dirname(__file__), '.command_tree.hash')
 intents = discord.Intents.default()
 intents.message_content = True
 intents.members = True
-bot = commands.Bot(command_prefix='!', intents=intents)
-
-@bot.event
-async def on_ready():
-    print(f'{bot.user} has connected to Discord')
-    try:
-        commands_path = os.path.join(os.path.dirname(__file__), 'commands')
-        if not os.path.exists(commands_path):
-            os.makedirs(commands_path)
-        
-        for filename in os.listdir(commands_path):
-            if filename.endswith('.py') and not filename.startswith('__'):
-                cog_name = filename[:-3]  
-                try:
-                    await bot.load_extension(f'commands.{cog_name}')
-                    print(f'Loaded: {cog_name}')
-                except Exception as e:
-                    print(f'failed to load {cog_name}: {e}')
-        
-        synced = await bot.tree.sync()
+
+class SetupMixin:
+    cluster_id = None
+    image_workers = None  # None gives the image pool one process per CPU
+
+    async def setup_hook(self):
+        # runs once per process before connecting, so gateway reconnects never repeat it
+        try:
+            commands_path = os.path.join(os.path.dirname(__file__), 'commands')
+            if not os.path.exists(commands_path):
+                os.makedirs(commands_path)
+            
+            for filename in sorted(os.listdir(commands_path)):
+                if filename.endswith('.py') and not filename.startswith('__'):
+                    cog_name = filename[:-3]  
+                    try:
+                        await self.load_extension(f'commands.{cog_name}')
+                        print(f'Loaded: {cog_name}')
+                    except Exception as e:
+                        print(f'failed to load {cog_name}: {e}')
+            
+            if not self.cluster_id:  # commands are global, one cluster syncing them is enough
+                await self.sync_commands()
+        except Exception as e:
+            print(f'Error during setup: {e}')
+
+    async def sync_commands(self):
+        payload = [command.to_dict(self.tree) for command in self.tree.get_commands()]
+        digest = hashlib.sha256(json.dumps([self.application_id, payload], sort_keys=True).encode()).hexdigest()
+        try:
+            with open(COMMAND_HASH_FILE) as f:
+                if f.read().strip() == digest:
+                    print('Command tree unchanged, skipping sync')
+                    return
+        except FileNotFoundError:
+            pass
+        synced = await self.tree.sync()
+        with open(COMMAND_HASH_FILE, 'w') as f:
+            f.write(digest)
         print(f'Synced {len(synced)} command(s)')
-    except Exception as e:
-        print(f'Error during setup: {e}')
+
+    async def on_ready(self):
+        print(f'{self.user} has connected to Discord')
+
+class AnonPostBot(SetupMixin, commands.Bot):
+    pass
+
+class ShardedAnonPostBot(SetupMixin, commands.AutoShardedBot):
+    pass
+
+def create_bot(sharded=SHARDED, shard_ids=None, shard_count=SHARD_COUNT, cluster_id=None, image_workers=None):
+    if sharded:
+        bot = ShardedAnonPostBot(command_prefix='!', intents=intents, shard_ids=shard_ids, shard_count=shard_count,
+                                 max_ratelimit_timeout=MAX_RATELIMIT_TIMEOUT)
+    else:
+        bot = AnonPostBot(command_prefix='!', intents=intents, max_ratelimit_timeout=MAX_RATELIMIT_TIMEOUT)
+    bot.cluster_id = cluster_id
+    bot.image_workers = image_workers
+    return bot
 
 if __name__ == '__main__':
     if not TOKEN:
         raise ValueError("No or improper token provided")
     
-    bot.run(TOKEN)
+    create_bot().run(TOKEN)
@@ -1,125 +1,391 @@
 import discord
 from discord import app_commands, ui
-from discord.ext import commands
+from discord.ext import commands, tasks
 import asyncio
-import random
-import string
-import sqlite3
-import aiohttp
+import math
+import time
 from io import BytesIO
+from utils.channels import DEFAULT_MAX_BODY, ChannelRegistry
+from utils.expiry import ExpiryQueue
+from utils.fetcher import FetchError, ImageFetcher
+from utils.floodgate import FloodError, FloodGate
+from utils.image_cache import ImageCache
+from utils.imaging import ImageError, ImageProcessor
+from utils.lru import LRUCache
+from utils.metrics import metrics
+from utils.post_ids import PostIdAllocator
+from utils.post_index import PostIndex
+from utils.outbound import REPLY, ROOT_POST, OutboundScheduler
+from utils.ratelimit import RateLimiter
+from utils.sequences import BlockAllocator
+from utils.state_version import StateVersion
+from utils.storage import Storage
+
+IMAGE_CACHE_DIR = None  # set to a directory path to spill downloaded images to disk; cleared when the bot stops
+IMAGE_MAX_DIMENSION = 2048
+IMAGE_MAX_BYTES = 4 * 1024 * 1024
+MAPPING_RETENTION_DAYS = 90  # reply buttons on posts older than this stop working
+SEARCH_RETENTION_DAYS = 90  # posts older than this drop out of /searchposts and /lookuppost
+MAPPING_CACHE_SIZE = 10000
+POST_HANDLE_CACHE_SIZE = 2000
+CLUSTER_SYNC_INTERVAL = 2  # seconds between checks for bans and channels changed by other cluster processes
+PER_GUILD_POST_NUMBERS = True  # False keeps one Post #N sequence shared by every server
+METRICS_PORT = None  # set to serve Prometheus metrics on http://127.0.0.1:<port>/metrics (cluster N uses port + N)
+METRICS_SAMPLE_RATE = 1.0  # fraction of calls whose latency is recorded
 
 class AnonPost(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.post_cooldowns = {}
-        self.post_counter = 0
-        self.db = sqlite3.connect("anon_channels.db")
-        self.cursor = self.db.cursor()
-        self._initialize_db()
-
-    def _initialize_db(self):
-        self.cursor.execute("""
-        CREATE TABLE IF NOT EXISTS anon_channels (
-            channel_id INTEGER PRIMARY KEY
-        )
-        """)
-        self.cursor.execute("""
+        self.banned_users = {}
+        self.ban_lock = asyncio.Lock()
+        self.ban_expiry = ExpiryQueue(self._expire_bans)
+        self.limiter = RateLimiter()
+        self.flood = FloodGate()
+        self.outbound = OutboundScheduler()
+        self.loop_lag_task = None
+        self.metrics_server = None
+        self.storage = Storage("anon_channels.db")
+        self.state_version = StateVersion(self.storage)
+        self.channels = ChannelRegistry(self.storage, self.state_version)
+        self.sequences = BlockAllocator(self.storage)
+        self.post_ids = PostIdAllocator(self.storage, self.sequences)
+        self.legacy_post_count = 0
+        self.legacy_channels = set()
+        self.post_mappings = LRUCache(MAPPING_CACHE_SIZE)
+        self.post_handles = LRUCache(POST_HANDLE_CACHE_SIZE)
+        self.post_index = PostIndex(self.storage)
+        self.fetcher = ImageFetcher()
+        self.images = ImageCache(self.fetcher, disk_path=IMAGE_CACHE_DIR)
+        self.imaging = ImageProcessor(max_dimension=IMAGE_MAX_DIMENSION, max_bytes=IMAGE_MAX_BYTES,
+                                      workers=getattr(bot, 'image_workers', None))
+
+    async def cog_load(self):
+        try:
+            await self._start()
+        except Exception:
+            # don't leave the storage thread and background tasks running for a cog that never loaded
+            await self.cog_unload()
+            raise
+
+    async def _start(self):
+        await self.storage.start()
+        await self._initialize_db()
+        self.ban_expiry.start()
+        self.limiter.start()
+        self.post_index.start()
+        self.bot.add_dynamic_items(PostButton, ReplyButton)
+        self.compact_post_mappings.start()
+        if getattr(self.bot, 'cluster_id', None) is not None:
+            self.sync_shared_state.start()
+        await self.fetcher.start()
+        await self.images.start()
+        self.imaging.start()
+        self._register_metrics()
+        self.loop_lag_task = asyncio.create_task(metrics.watch_loop_lag())
+        if METRICS_PORT:
+            # every cluster process serves its own metrics
+            self.metrics_server = await metrics.serve(METRICS_PORT + (getattr(self.bot, 'cluster_id', None) or 0))
+
+    async def cog_unload(self):
+        self.bot.remove_dynamic_items(PostButton, ReplyButton)
+        self.compact_post_mappings.cancel()
+        self.sync_shared_state.cancel()
+        if self.loop_lag_task is not None:
+            self.loop_lag_task.cancel()
+            self.loop_lag_task = None
+        if self.metrics_server is not None:
+            await self.metrics_server.cleanup()
+            self.metrics_server = None
+        await self.outbound.close()
+        await self.sequences.release()
+        await self.imaging.close()
+        await self.fetcher.close()
+        await self.images.close()
+        await self.limiter.close()
+        await self.ban_expiry.close()
+        await self.post_index.close()
+        await self.storage.close()
+
+    def _register_metrics(self):
+        metrics.sample_rate = METRICS_SAMPLE_RATE
+        metrics.gauge('storage_queue_depth', self.storage.depth)
+        metrics.gauge('send_queue_depth', self.outbound.depth)
+        metrics.gauge('image_cache_hit_ratio', self.images.hit_rate)
+        metrics.gauge('image_normalize_hit_ratio', self.imaging.hit_rate)
+        metrics.gauge('image_cache_memory_bytes', lambda: self.images.stats()['memory_bytes'])
+        metrics.gauge('post_mapping_cache_size', lambda: len(self.post_mappings))
+        metrics.gauge('post_index_pending', lambda: len(self.post_index))
+        metrics.gauge('active_rate_limits', lambda: len(self.limiter))
+        metrics.gauge('flood_window_entries', lambda: len(self.flood))
+        metrics.gauge('banned_users', lambda: len(self.banned_users))
+        metrics.gauge('loop_lag_seconds', lambda: metrics.last_loop_lag)
+
+    async def _initialize_db(self):
+        await self.state_version.load()
+        await self.channels.load()
+        await self.sequences.load()
+        await self.post_ids.load()
+        await self.post_index.load()
+        await self.storage.execute("""
         CREATE TABLE IF NOT EXISTS banned_users (
             user_id INTEGER PRIMARY KEY,
             ban_end REAL
         )
         """)
-        self.cursor.execute("""
+        await self.storage.execute("""
         CREATE TABLE IF NOT EXISTS post_mappings (
             post_id TEXT PRIMARY KEY,
             message_id INTEGER,
-            channel_id INTEGER
+            channel_id INTEGER,
+            created_at REAL
         )
         """)
-        self.cursor.execute("""
+        columns = {row[1] for row in await self.storage.fetchall("PRAGMA table_info(post_mappings)")}
+        if 'created_at' not in columns:
+            await self.storage.execute("ALTER TABLE post_mappings ADD COLUMN created_at REAL")
+            await self.storage.execute("UPDATE post_mappings SET created_at = ?", (time.time(),))
+        await self.storage.execute("CREATE INDEX IF NOT EXISTS post_mappings_created_at ON post_mappings (created_at)")
+        await self.storage.execute("""
         CREATE TABLE IF NOT EXISTS post_counter (
             id INTEGER PRIMARY KEY,
             count INTEGER
         )
         """)
-        self.cursor.execute("INSERT OR IGNORE INTO post_counter (id, count) VALUES (1, 0)")
-        self.db.commit()
-        self.banned_users = {}
-        self.cursor.execute("SELECT user_id, ban_end FROM banned_users")
-        for user_id, ban_end in self.cursor.fetchall():
-            self.banned_users[user_id] = ban_end
-        self.cursor.execute("SELECT count FROM post_counter WHERE id = 1")
-        result = self.cursor.fetchone()
-        self.post_counter = result[0] if result else 0
-
-    def _increment_post_counter(self):
-        self.post_counter += 1
-        self.cursor.execute("UPDATE post_counter SET count = ? WHERE id = 1", (self.post_counter,))
-        self.db.commit()
-        return self.post_counter
-
-    def _add_anon_channel(self, channel_id):
-        self.cursor.execute("INSERT OR IGNORE INTO anon_channels (channel_id) VALUES (?)", (channel_id,))
-        self.db.commit()
-
-    def _remove_anon_channel(self, channel_id):
-        self.cursor.execute("DELETE FROM anon_channels WHERE channel_id = ?", (channel_id,))
-        self.db.commit()
-
-    def _is_anon_channel(self, channel_id):
-        self.cursor.execute("SELECT 1 FROM anon_channels WHERE channel_id = ?", (channel_id,))
-        return self.cursor.fetchone() is not None
-
-    def _add_ban(self, user_id, ban_end):
-        self.cursor.execute("INSERT OR REPLACE INTO banned_users (user_id, ban_end) VALUES (?, ?)", (user_id, ban_end))
-        self.db.commit()
-        self.banned_users[user_id] = ban_end
+        await self.storage.execute("INSERT OR IGNORE INTO post_counter (id, count) VALUES (1, 0)")
+        await self._migrate_ban_times()
+        await self._load_bans()
+        # post_counter is only read now: it seeds the block-allocated sequences below
+        result = await self.storage.fetchone("SELECT count FROM post_counter WHERE id = 1")
+        self.legacy_post_count = result[0] if result else 0
+        await self._record_legacy_channels()
+
+    async def _record_legacy_channels(self):
+        # The old counter was shared by every server, so only the channels that
+        # already existed when post numbers moved to sequences continue from it.
+        # The snapshot is taken once, on the first start with the sequences table.
+        await self.storage.execute("""
+        CREATE TABLE IF NOT EXISTS legacy_post_channels (
+            channel_id INTEGER PRIMARY KEY
+        )
+        """)
 
-    def _check_ban(self, user_id):
-        if user_id in self.banned_users:
-            ban_end = self.banned_users[user_id]
-            current_time = asyncio.get_event_loop().time()
-            if ban_end is None or current_time < ban_end:
-                return True
+        def record(db):
+            if db.execute("SELECT 1 FROM meta WHERE key = 'legacy_post_channels'").fetchone():
+                return
+            db.execute("INSERT INTO meta (key, value) VALUES ('legacy_post_channels', 1)")
+            if not db.execute("SELECT 1 FROM sequences WHERE name = 'post' OR name LIKE 'post:%'").fetchone():
+                db.execute("INSERT OR IGNORE INTO legacy_post_channels (channel_id) SELECT channel_id FROM anon_channels")
+
+        await self.storage.run(record)
+        rows = await self.storage.fetchall("SELECT channel_id FROM legacy_post_channels")
+        self.legacy_channels = {row[0] for row in rows}
+
+    async def _increment_post_counter(self, guild_id, channel_id):
+        if not PER_GUILD_POST_NUMBERS:
+            return await self.sequences.next('post', start=self.legacy_post_count)
+        # start only matters for the first number a guild's sequence hands out
+        start = self.legacy_post_count if channel_id in self.legacy_channels else 0
+        return await self.sequences.next(f'post:{guild_id}', start=start)
+
+    async def _migrate_ban_times(self):
+        # Older versions stored ban ends as event loop (monotonic) time. That is the
+        # system uptime clock, so it can be moved to wall-clock time as long as the
+        # machine has not rebooted since; anything below 1e9 cannot be a Unix time.
+        offset = time.time() - time.monotonic()
+        await self.storage.execute("UPDATE banned_users SET ban_end = ban_end + ? WHERE ban_end IS NOT NULL AND ban_end < 1000000000", (offset,))
+
+    async def _load_bans(self):
+        async with self.ban_lock:
+            banned_users = dict(await self.storage.fetchall("SELECT user_id, ban_end FROM banned_users"))
+            for user_id in self.banned_users.keys() - banned_users.keys():
+                self.ban_expiry.discard(user_id)
+            for user_id, ban_end in banned_users.items():
+                if ban_end is None:
+                    self.ban_expiry.discard(user_id)
+                elif self.ban_expiry.get(user_id) != ban_end:
+                    self.ban_expiry.set(user_id, ban_end)
+            self.banned_users = banned_users
+
+    async def _add_ban(self, user_id, ban_end):
+        # The lock only covers the in-memory change and queueing the write, which
+        # puts it ahead of any later reload; the commit is awaited outside of it
+        # so concurrent bans share one group commit.
+        async with self.ban_lock:
+            self.banned_users[user_id] = ban_end
+            if ban_end is None:
+                self.ban_expiry.discard(user_id)
             else:
-                self.cursor.execute("DELETE FROM banned_users WHERE user_id = ?", (user_id,))
-                self.db.commit()
-                del self.banned_users[user_id]
-        return False
+                self.ban_expiry.set(user_id, ban_end)
+            write = self.storage.execute("INSERT OR REPLACE INTO banned_users (user_id, ban_end) VALUES (?, ?)", (user_id, ban_end))
+            bump = self.state_version.bump()
+        await asyncio.gather(write, bump)
+
+    async def _expire_bans(self, user_ids):
+        async with self.ban_lock:
+            now = time.time()
+            # a ban re-issued while this call waited for the lock has a later end; keep it
+            expired = []
+            for user_id in user_ids:
+                ban_end = self.banned_users.get(user_id)
+                if ban_end is not None and ban_end <= now:
+                    del self.banned_users[user_id]
+                    expired.append(user_id)
+            if not expired:
+                return
+            write = self.storage.executemany("DELETE FROM banned_users WHERE user_id = ? AND ban_end <= ?", [(user_id, now) for user_id in expired])
+            bump = self.state_version.bump()
+        await asyncio.gather(write, bump)
 
-    def _save_post_mapping(self, post_id, message_id, channel_id):
-        self.cursor.execute("INSERT OR REPLACE INTO post_mappings (post_id, message_id, channel_id) VALUES (?, ?, ?)", 
-                          (post_id, message_id, channel_id))
-        self.db.commit()
+    @tasks.loop(seconds=CLUSTER_SYNC_INTERVAL)
+    async def sync_shared_state(self):
+        # the version only moves on ban and channel writes, not on every post
+        if await self.state_version.changed():
+            await self._load_bans()
+            await self.channels.reload()
 
-    def _get_post_mapping(self, post_id):
-        self.cursor.execute("SELECT message_id, channel_id FROM post_mappings WHERE post_id = ?", (post_id,))
-        return self.cursor.fetchone()
+    def _check_ban(self, user_id):
+        if user_id not in self.banned_users:
+            return False
+        ban_end = self.banned_users[user_id]
+        return ban_end is None or time.time() < ban_end
+
+    def _post_retry_after(self, user_id, settings):
+        return max(self.limiter.retry_after((settings.channel_id, user_id), 1, settings.cooldown),
+                   self.limiter.retry_after(settings.channel_id, settings.rate_limit, 60))
+
+    def _take_post_slot(self, user_id, settings):
+        retry_after = self._post_retry_after(user_id, settings)
+        if retry_after:
+            return retry_after
+        self.limiter.consume((settings.channel_id, user_id), 1, settings.cooldown)
+        self.limiter.consume(settings.channel_id, settings.rate_limit, 60)
+        return 0
+
+    async def _save_post_mapping(self, post_id, message_id, channel_id):
+        self.post_mappings.put(post_id, (message_id, channel_id))
+        await self.storage.execute("INSERT INTO post_mappings (post_id, message_id, channel_id, created_at) VALUES (?, ?, ?, ?)",
+                                   (post_id, message_id, channel_id, time.time()))
+
+    async def _get_post_mapping(self, post_id):
+        mapping = self.post_mappings.get(post_id)
+        metrics.inc('mapping_cache_miss' if mapping is None else 'mapping_cache_hit')
+        if mapping is None:
+            mapping = await self.storage.fetchone("SELECT message_id, channel_id FROM post_mappings WHERE post_id = ?", (post_id,))
+            if mapping is not None:
+                self.post_mappings.put(post_id, mapping)
+        return mapping
+
+    @tasks.loop(hours=1)
+    async def compact_post_mappings(self):
+        cutoff = time.time() - MAPPING_RETENTION_DAYS * 86400
+        while True:
+            rows = await self.storage.fetchall("SELECT post_id FROM post_mappings WHERE created_at < ? LIMIT 1000", (cutoff,))
+            if not rows:
+                break
+            for post_id, in rows:
+                self.post_mappings.pop(post_id)
+                self.post_handles.pop(post_id)
+            await self.storage.executemany("DELETE FROM post_mappings WHERE post_id = ?", rows)
+        await self.post_index.prune(time.time() - SEARCH_RETENTION_DAYS * 86400)
+        self.flood.prune()
+
+    def _post_handle(self, post_id, message_id, channel_id, guild_id):
+        # A partial message is enough to open the reply modal; nothing is fetched
+        # until the reply is actually sent.
+        handle = self.post_handles.get(post_id)
+        if handle is None:
+            channel = self.bot.get_channel(channel_id) or self.bot.get_partial_messageable(channel_id, guild_id=guild_id)
+            handle = PostHandle(channel.get_partial_message(message_id))
+            self.post_handles.put(post_id, handle)
+        return handle
+
+    async def _reply_thread(self, handle, post_id):
+        if handle.thread is not None:
+            return handle.thread
+        async with handle.lock:
+            if handle.thread is None:
+                message = handle.message
+                thread = getattr(message, 'thread', None)
+                if thread is None and message.guild is not None:
+                    # a thread started from a message shares the message's ID
+                    thread = message.guild.get_thread(message.id)
+                if thread is None:
+                    try:
+                        thread = await self.outbound.submit(message.channel.id, REPLY, lambda: message.create_thread(
+                            name=f'Replies to {post_id}', auto_archive_duration=60))
+                    except discord.HTTPException as e:
+                        if e.code != 160004:  # a thread has already been created for this message
+                            raise
+                        thread = await self.bot.fetch_channel(message.id)
+                handle.thread = thread
+        return handle.thread
+
+    async def _load_image(self, image_url, settings):
+        image = await self.images.get(image_url)
+        # the same picture behind a different URL is only recognisable once downloaded
+        if not self.flood.admit(settings, digest=image.digest):
+            metrics.inc('flood_rejected')
+            raise FloodError('this image was posted too many times recently')
+        with metrics.timed('image_normalize'):
+            return await self.imaging.normalize(image.data, image.digest)
 
     @app_commands.command(name='setupanonch', description='Set up a channel to handle anonymous posts')
     @app_commands.checks.has_permissions(administrator=True)
     @app_commands.describe(channel='✅ Set up the channel')
     async def setup_anon_channel(self, interaction: discord.Interaction, channel: discord.TextChannel):
-        if self._is_anon_channel(channel.id):
+        if channel.id in self.channels:
             await interaction.response.send_message('❌ This channel is already set up.', ephemeral=True)
             return
-        self._add_anon_channel(channel.id)
         embed = discord.Embed(title='👻 This channel is now accepting Anonymous posts', description='', color=discord.Color.green())
         view = ui.View()
-        view.add_item(ui.Button(label='Post 👻', style=discord.ButtonStyle.success, custom_id='post_button'))
-        await channel.send(embed=embed, view=view)
+        view.add_item(PostButton())
+        # the button goes out first, so a failed send leaves no channel registered without one
+        try:
+            await channel.send(embed=embed, view=view)
+        except discord.RateLimited as e:
+            await interaction.response.send_message(f'❌ Discord is rate limiting this channel, try again in {math.ceil(e.retry_after)} seconds.', ephemeral=True)
+            return
+        await self.channels.add(channel.id)
         await interaction.response.send_message(f'Anonymous channel set up in {channel.mention}.', ephemeral=True)
 
     @app_commands.command(name='removeanonch', description='Remove an anonymous channel setup')
     @app_commands.checks.has_permissions(administrator=True)
     @app_commands.describe(channel='The channel to remove from anonymous posts')
     async def remove_anon_channel(self, interaction: discord.Interaction, channel: discord.TextChannel):
-        if not self._is_anon_channel(channel.id):
+        if channel.id not in self.channels:
             await interaction.response.send_message('❌ This channel is not set up as anonymous.', ephemeral=True)
             return
-        self._remove_anon_channel(channel.id)
+        await self.channels.remove(channel.id)
         await interaction.response.send_message(f'✅ Anonymous setup removed from {channel.mention}.', ephemeral=True)
 
+    @app_commands.command(name='anonchsettings', description='View or change the settings of an anonymous channel')
+    @app_commands.checks.has_permissions(administrator=True)
+    @app_commands.describe(
+        channel='The anonymous channel to configure',
+        cooldown='Seconds a user has to wait between posts',
+        images='Whether posts may include an image',
+        max_length='Maximum length of a post body',
+        rate_limit='Posts per minute allowed across the whole channel (0 for unlimited)',
+        duplicates='Copies of the same or nearly the same text or image allowed per duplicate window (0 for unlimited)',
+        duplicate_window='Seconds a post counts towards the duplicate limit'
+    )
+    async def anon_channel_settings(self, interaction: discord.Interaction, channel: discord.TextChannel,
+                                    cooldown: app_commands.Range[int, 0, 86400] = None, images: bool = None,
+                                    max_length: app_commands.Range[int, 1, DEFAULT_MAX_BODY] = None,
+                                    rate_limit: app_commands.Range[int, 0, 600] = None,
+                                    duplicates: app_commands.Range[int, 0, 100] = None,
+                                    duplicate_window: app_commands.Range[int, 10, 86400] = None):
+        if channel.id not in self.channels:
+            await interaction.response.send_message('❌ This channel is not set up as anonymous.', ephemeral=True)
+            return
+        settings = await self.channels.update(channel.id, cooldown=cooldown, allow_images=images, max_body=max_length, rate_limit=rate_limit,
+                                              flood_limit=duplicates, flood_window=duplicate_window)
+        await interaction.response.send_message(
+            f'Settings for {channel.mention}: cooldown {int(settings.cooldown)}s, '
+            f'images {"allowed" if settings.allow_images else "disabled"}, max length {settings.max_body}, '
+            f'{settings.rate_limit or "unlimited"} posts per minute, '
+            f'{settings.flood_limit or "unlimited"} copies of the same post per {int(settings.flood_window)}s.', ephemeral=True)
+
     @app_commands.command(name='banuser', description='Ban a user from posting in anonymous channels')
     @app_commands.checks.has_permissions(administrator=True)
     @app_commands.describe(
@@ -139,63 +405,153 @@ class AnonPost(commands.Cog):
             return
         ban_end = None
         if duration.value == '1_day':
-            ban_end = asyncio.get_event_loop().time() + 86400
+            ban_end = time.time() + 86400
         elif duration.value == '1_month':
-            ban_end = asyncio.get_event_loop().time() + 2592000
-        self._add_ban(user_id, ban_end)
+            ban_end = time.time() + 2592000
+        await self._add_ban(user_id, ban_end)
         await interaction.response.send_message(f'User {user_id} banned from posting for {duration.name}.', ephemeral=True)
 
-    @commands.Cog.listener()
-    async def on_interaction(self, interaction: discord.Interaction):
-        if interaction.type != discord.InteractionType.component:
+    @app_commands.command(name='searchposts', description='Search the anonymous posts and replies of this server')
+    @app_commands.checks.has_permissions(administrator=True)
+    @app_commands.describe(query='Words to look for; end a word with * to match its prefix')
+    async def search_posts(self, interaction: discord.Interaction, query: str):
+        results = await self.post_index.search(interaction.guild_id, query)
+        if not results:
+            await interaction.response.send_message('No matching posts found.', ephemeral=True)
+            return
+        lines = []
+        for result in results:
+            kind = 'Reply to' if result.is_reply else 'Post'
+            link = _jump_url(interaction.guild_id, result.channel_id, result.message_id)
+            lines.append(f'**Post #{result.post_number}** · {kind} `{result.post_id}` · <t:{int(result.created_at)}:R> · {link}\n{result.snippet}')
+        await interaction.response.send_message('\n'.join(lines)[:2000], ephemeral=True)
+
+    @app_commands.command(name='lookuppost', description='Find an anonymous post by its post ID')
+    @app_commands.checks.has_permissions(administrator=True)
+    @app_commands.describe(post_id='The ID shown in the footer of the post')
+    async def lookup_post(self, interaction: discord.Interaction, post_id: str):
+        post_id = self.post_ids.parse(post_id)
+        if post_id is None:
+            await interaction.response.send_message('❌ That is not a valid post ID.', ephemeral=True)
             return
-        custom_id = interaction.data.get('custom_id')
-        if custom_id not in ('post_button',) and not custom_id.startswith('reply_'):
+        post, replies = await self.post_index.lookup(interaction.guild_id, post_id)
+        if post is None:
+            # posts made before the index existed are still in post_mappings
+            mapping = await self._get_post_mapping(post_id)
+            channel = self.bot.get_channel(mapping[1]) if mapping else None
+            if channel is None or channel.guild.id != interaction.guild_id:
+                await interaction.response.send_message('❌ Post not found.', ephemeral=True)
+                return
+            await interaction.response.send_message(f'Post `{post_id}`: {_jump_url(interaction.guild_id, mapping[1], mapping[0])}', ephemeral=True)
             return
+        await interaction.response.send_message(
+            f'**Post #{post.post_number}** `{post_id}` · <t:{int(post.created_at)}:f> · {replies} replies · '
+            f'{_jump_url(interaction.guild_id, post.channel_id, post.message_id)}\n{post.title}\n{post.snippet}'[:2000], ephemeral=True)
 
+    @metrics.measure('button')
+    async def on_button(self, interaction: discord.Interaction, post_id=None):
+        # shared entry point of the persistent Post (post_id None) and Reply buttons
         if self._check_ban(interaction.user.id):
             await interaction.response.send_message('❌ You are banned from posting.', ephemeral=True)
             return
 
-        if interaction.user.id in self.post_cooldowns:
-            cooldown_end = self.post_cooldowns[interaction.user.id]
-            current_time = asyncio.get_event_loop().time()
-            if current_time < cooldown_end:
-                await interaction.response.send_message(f'❌ You are on cooldown. Try again in {int(cooldown_end - current_time)} seconds.', ephemeral=True)
-                return
+        retry_after = self._post_retry_after(interaction.user.id, self.channels.settings_for(interaction.channel_id))
+        if retry_after:
+            await interaction.response.send_message(f'❌ You are on cooldown. Try again in {math.ceil(retry_after)} seconds.', ephemeral=True)
+            return
 
-        if custom_id == 'post_button':
-            modal = PostModal(self)
+        if post_id is None:
+            modal = PostModal(self, self.channels.settings_for(interaction.channel_id))
             await interaction.response.send_modal(modal)
-        elif custom_id.startswith('reply_'):
-            post_id = custom_id.split('_')[1]
-            mapping = self._get_post_mapping(post_id)
+        else:
+            mapping = await self._get_post_mapping(post_id)
             if not mapping:
                 await interaction.response.send_message('❌ Post not found for replying.', ephemeral=True)
                 return
 
             message_id, channel_id = mapping
-            try:
-                channel = self.bot.get_channel(channel_id)
-                message = await channel.fetch_message(message_id)
-                await interaction.response.send_modal(ReplyModal(self, message, post_id))
-            except discord.errors.NotFound:
-                await interaction.response.send_message('❌ Original post not found.', ephemeral=True)
-                return
+            handle = self._post_handle(post_id, message_id, channel_id, interaction.guild_id)
+            await interaction.response.send_modal(ReplyModal(self, handle, post_id, self.channels.settings_for(interaction.channel_id)))
+
+class PostButton(ui.DynamicItem[ui.Button], template=r'post_button'):
+    def __init__(self):
+        super().__init__(ui.Button(label='Post 👻', style=discord.ButtonStyle.success, custom_id='post_button'))
+
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: ui.Button, match):
+        return cls()
+
+    async def callback(self, interaction: discord.Interaction):
+        await interaction.client.get_cog('AnonPost').on_button(interaction)
+
+class ReplyButton(ui.DynamicItem[ui.Button], template=r'reply_(?P<post_id>[A-Z0-9]+)'):
+    def __init__(self, post_id):
+        super().__init__(ui.Button(label='Reply 💬', style=discord.ButtonStyle.danger, custom_id=f'reply_{post_id}'))
+        self.post_id = post_id
+
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: ui.Button, match):
+        return cls(match['post_id'])
+
+    async def callback(self, interaction: discord.Interaction):
+        await interaction.client.get_cog('AnonPost').on_button(interaction, self.post_id)
+
+class PostHandle:
+    __slots__ = ('message', 'thread', 'lock')
+
+    def __init__(self, message, thread=None):
+        self.message = message
+        self.thread = thread
+        self.lock = asyncio.Lock()
+
+def _files(attachments):
+    # built per attempt: the library closes files after a send, and the send queue may retry it
+    return [discord.File(BytesIO(data), filename=filename) for data, filename in attachments]
+
+def _jump_url(guild_id, channel_id, message_id):
+    return f'https://discord.com/channels/{guild_id}/{channel_id}/{message_id}'
+
+def _apply_channel_settings(modal, settings):
+    modal.body_input.max_length = settings.max_body
+    if not settings.allow_images:
+        modal.remove_item(modal.image_input)
+
+async def _check_submission(modal, interaction, settings):
+    if len(modal.body_input.value) > settings.max_body:
+        await interaction.response.send_message(f'❌ Posts in this channel are limited to {settings.max_body} characters.', ephemeral=True)
+        return False
+    if modal.image_input.value and not settings.allow_images:
+        await interaction.response.send_message('❌ Images are disabled in this channel.', ephemeral=True)
+        return False
+    retry_after = modal.cog._take_post_slot(interaction.user.id, settings)
+    if retry_after:
+        await interaction.response.send_message(f'❌ You are on cooldown. Try again in {math.ceil(retry_after)} seconds.', ephemeral=True)
+        return False
+    # checked before anything is downloaded or sent; image contents are checked again in _load_image
+    if not modal.cog.flood.admit(settings, modal.body_input.value, modal.image_input.value):
+        metrics.inc('flood_rejected')
+        await interaction.response.send_message('❌ This was already posted too many times recently.', ephemeral=True)
+        return False
+    return True
 
 class PostModal(ui.Modal, title='Create a Post'):
     title_input = ui.TextInput(label='Title (optional)', style=discord.TextStyle.short, placeholder='Enter post title', required=False)
     body_input = ui.TextInput(label='Body', style=discord.TextStyle.long, placeholder='Enter post body', required=True)
     image_input = ui.TextInput(label='Image URL (optional)', style=discord.TextStyle.short, placeholder='Enter image URL', required=False)
 
-    def __init__(self, cog):
+    def __init__(self, cog, settings):
         super().__init__()
         self.cog = cog
+        _apply_channel_settings(self, settings)
 
+    @metrics.measure('post_submit')
     async def on_submit(self, interaction: discord.Interaction):
-        if not self.cog._is_anon_channel(interaction.channel_id):
+        settings = self.cog.channels.get(interaction.channel_id)
+        if settings is None:
             await interaction.response.send_message('❌ This channel is not set up for anonymous posts.', ephemeral=True)
             return
+        if not await _check_submission(self, interaction, settings):
+            return
 
         await interaction.response.send_message('✅ Post is being created...', ephemeral=True)
 
@@ -203,86 +559,92 @@ class PostModal(ui.Modal, title='Create a Post'):
             title = self.title_input.value or ''
             body = self.body_input.value
             image_url = self.image_input.value
-            post_number = self.cog._increment_post_counter()
+            post_number = await self.cog._increment_post_counter(interaction.guild_id, settings.channel_id)
             post_name = f'Post #{post_number}'
-            post_id = ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
+            post_id = await self.cog.post_ids.next()
 
             embed = discord.Embed(title=title, description=body, color=0x000001)
             embed.set_author(name=post_name, icon_url=interaction.client.user.avatar.url)
             embed.set_footer(text=f'Post ID: {post_id}')
             embed.timestamp = discord.utils.utcnow()  # Add timestamp
 
-            files = []
+            attachments = []
             if image_url:
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(image_url) as resp:
-                        if resp.status == 200:
-                            image_data = await resp.read()
-                            image_buffer = BytesIO(image_data)
-                            file = discord.File(image_buffer, filename='image.png')
-                            files.append(file)
-                            embed.set_image(url='attachment://image.png')
-                        else:
-                            await interaction.followup.send('❌ Failed to download image.', ephemeral=True)
-                            return
+                try:
+                    image_data, extension = await self.cog._load_image(image_url, settings)
+                except (FetchError, ImageError, FloodError) as e:
+                    await interaction.followup.send(f'❌ Failed to load image: {e}.', ephemeral=True)
+                    return
+                filename = f'image.{extension}'
+                attachments.append((image_data, filename))
+                embed.set_image(url=f'attachment://{filename}')
 
             view = ui.View()
-            view.add_item(ui.Button(label='Post 👻', style=discord.ButtonStyle.success, custom_id='post_button'))
-            view.add_item(ui.Button(label='Reply 💬', style=discord.ButtonStyle.danger, custom_id=f'reply_{post_id}'))
+            view.add_item(PostButton())
+            view.add_item(ReplyButton(post_id))
 
-            message = await interaction.channel.send(embed=embed, view=view, files=files)
-            self.cog._save_post_mapping(post_id, message.id, interaction.channel_id)
-            self.cog.post_cooldowns[interaction.user.id] = asyncio.get_event_loop().time() + 10
+            message = await self.cog.outbound.submit(interaction.channel_id, ROOT_POST, lambda: interaction.channel.send(
+                embed=embed, view=view, files=_files(attachments)))
+            await self.cog._save_post_mapping(post_id, message.id, interaction.channel_id)
+            self.cog.post_handles.put(post_id, PostHandle(message))
+            self.cog.post_index.add(post_id, post_number, interaction.guild_id, interaction.channel_id, message.id, body, title)
 
+            metrics.inc('posts')
             await interaction.followup.send('✅ Post created successfully.', ephemeral=True)
         except Exception as e:
+            metrics.inc('post_errors')
             await interaction.followup.send(f'❌ Error creating post: {str(e)}', ephemeral=True)
 
 class ReplyModal(ui.Modal, title='Reply to Post'):
     body_input = ui.TextInput(label='Reply Body', style=discord.TextStyle.long, placeholder='Enter your reply', required=True)
     image_input = ui.TextInput(label='Image URL (optional)', style=discord.TextStyle.short, placeholder='Enter image URL', required=False)
 
-    def __init__(self, cog, message, post_id):
+    def __init__(self, cog, handle, post_id, settings):
         super().__init__()
         self.cog = cog
-        self.message = message
+        self.handle = handle
         self.post_id = post_id
+        _apply_channel_settings(self, settings)
 
+    @metrics.measure('reply_submit')
     async def on_submit(self, interaction: discord.Interaction):
+        settings = self.cog.channels.settings_for(interaction.channel_id)
+        if not await _check_submission(self, interaction, settings):
+            return
         await interaction.response.send_message('✅ Reply is being sent...', ephemeral=True)
 
         try:
             body = self.body_input.value
             image_url = self.image_input.value
-            post_number = self.cog._increment_post_counter()
+            post_number = await self.cog._increment_post_counter(interaction.guild_id, settings.channel_id)
             post_name = f'Post #{post_number}'
             embed = discord.Embed(description=body, color=0x26C6DA)
             embed.set_author(name=post_name, icon_url=interaction.client.user.avatar.url)
             embed.set_footer(text=f'Replied by {post_name}')
             embed.timestamp = discord.utils.utcnow()  # Add timestamp
 
-            files = []
+            attachments = []
             if image_url:
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(image_url) as resp:
-                        if resp.status == 200:
-                            image_data = await resp.read()
-                            image_buffer = BytesIO(image_data)
-                            file = discord.File(image_buffer, filename='image.png')
-                            files.append(file)
-                            embed.set_image(url='attachment://image.png')
-                        else:
-                            await interaction.followup.send('❌ Failed to download image.', ephemeral=True)
-                            return
-
-            thread = self.message.thread
-            if not thread:
-                thread = await self.message.create_thread(name=f'Replies to {self.post_id}', auto_archive_duration=60)
-
-            await thread.send(embed=embed, files=files)
-            self.cog.post_cooldowns[interaction.user.id] = asyncio.get_event_loop().time() + 10
+                try:
+                    image_data, extension = await self.cog._load_image(image_url, settings)
+                except (FetchError, ImageError, FloodError) as e:
+                    await interaction.followup.send(f'❌ Failed to load image: {e}.', ephemeral=True)
+                    return
+                filename = f'image.{extension}'
+                attachments.append((image_data, filename))
+                embed.set_image(url=f'attachment://{filename}')
+
+            thread = await self.cog._reply_thread(self.handle, self.post_id)
+            message = await self.cog.outbound.submit(thread.id, REPLY, lambda: thread.send(embed=embed, files=_files(attachments)))
+            self.cog.post_index.add(self.post_id, post_number, interaction.guild_id, thread.id, message.id, body, is_reply=True)
+            metrics.inc('replies')
             await interaction.followup.send('✅ Reply sent successfully.', ephemeral=True)
+        except discord.NotFound:
+            # the post or its thread was deleted; forget the handle so the next click starts fresh
+            self.cog.post_handles.pop(self.post_id)
+            await interaction.followup.send('❌ Original post not found.', ephemeral=True)
         except Exception as e:
+            metrics.inc('reply_errors')
             await interaction.followup.send(f'❌ Error sending reply: {str(e)}', ephemeral=True)
 
 async def setup(bot):
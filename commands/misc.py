@@ -2,13 +2,21 @@ import discord
 from discord.ext import commands
 from discord import app_commands
 import asyncio
-import aiohttp
-from io import BytesIO
+import math
+from utils.fetcher import FetchError, ImageFetcher
+from utils.metrics import metrics
 
 class BotSettings(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
 
+    async def _fetch_image(self, url):
+        anon = self.bot.get_cog('AnonPost')
+        if anon is not None:
+            return await anon.fetcher.fetch(url)
+        async with ImageFetcher() as fetcher:
+            return await fetcher.fetch(url)
+
     async def bot_owner_check(self, interaction: discord.Interaction) -> bool:
         return await self.bot.is_owner(interaction.user)
 
@@ -21,6 +29,8 @@ class BotSettings(commands.Cog):
             await interaction.response.send_message(f'Bot name has been changed to {name}!', ephemeral=True)
         except discord.Forbidden:
             await interaction.response.send_message('I don\'t have permission to change my username.', ephemeral=True)
+        except discord.RateLimited as e:
+            await interaction.response.send_message(f'Discord is rate limiting this, try again in {math.ceil(e.retry_after)} seconds.', ephemeral=True)
         except discord.HTTPException as e:
             await interaction.response.send_message(f'Failed to change name: {e}', ephemeral=True)
         except Exception as e:
@@ -31,22 +41,20 @@ class BotSettings(commands.Cog):
     @app_commands.describe(avatar_url='The URL of the new avatar image')
     async def set_avatar(self, interaction: discord.Interaction, avatar_url: str):
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(avatar_url) as response:
-                    if response.status != 200:
-                        await interaction.response.send_message('Failed to fetch the avatar image. Please check the URL.', ephemeral=True)
-                        return
-                    content_type = response.headers.get('content-type', '')
-                    if not content_type.startswith('image/'):
-                        await interaction.response.send_message('URL does not point to a valid image.', ephemeral=True)
-                        return
-                    avatar_bytes = await response.read()
-                    avatar_buffer = BytesIO(avatar_bytes)
-                    avatar_buffer.seek(0)
-            await self.bot.user.edit(avatar=avatar_buffer.read())
+            try:
+                avatar = await self._fetch_image(avatar_url)
+            except FetchError:
+                await interaction.response.send_message('Failed to fetch the avatar image. Please check the URL.', ephemeral=True)
+                return
+            if not avatar.content_type.startswith('image/'):
+                await interaction.response.send_message('URL does not point to a valid image.', ephemeral=True)
+                return
+            await self.bot.user.edit(avatar=avatar.data)
             await interaction.response.send_message('Bot avatar has been changed!', ephemeral=True)
         except discord.Forbidden:
             await interaction.response.send_message('I don\'t have permission to change my avatar.', ephemeral=True)
+        except discord.RateLimited as e:
+            await interaction.response.send_message(f'Discord is rate limiting this, try again in {math.ceil(e.retry_after)} seconds.', ephemeral=True)
         except discord.HTTPException as e:
             await interaction.response.send_message(f'Failed to change avatar: {e}', ephemeral=True)
         except Exception as e:
@@ -61,6 +69,8 @@ class BotSettings(commands.Cog):
             await interaction.response.send_message(f'Message sent to {channel.mention}', ephemeral=True)
         except discord.Forbidden:
             await interaction.response.send_message('I don\'t have permission to send messages in that channel.', ephemeral=True)
+        except discord.RateLimited as e:
+            await interaction.response.send_message(f'Discord is rate limiting this, try again in {math.ceil(e.retry_after)} seconds.', ephemeral=True)
         except discord.HTTPException as e:
             await interaction.response.send_message(f'Failed to send message: {e}', ephemeral=True)
         except Exception as e:
@@ -90,5 +100,19 @@ class BotSettings(commands.Cog):
         except Exception as e:
             await interaction.response.send_message(f'An error occurred: {e}', ephemeral=True)
 
+    @app_commands.command(name='stats', description='Show where the bot spends its time')
+    @app_commands.check(bot_owner_check)
+    async def stats(self, interaction: discord.Interaction):
+        lines = [f'{"stage":<16} {"count":>8} {"p50 ms":>9} {"p99 ms":>9}']
+        for stage, histogram in sorted(metrics.stages.items()):
+            lines.append(f'{stage:<16} {histogram.count:>8} {histogram.quantile(0.5) * 1000:>9.1f} {histogram.quantile(0.99) * 1000:>9.1f}')
+        lines.append('')
+        for event, value in sorted(metrics.counters.items()):
+            lines.append(f'{event:<26} {value:>12}')
+        for name, value in sorted(metrics.read_gauges().items()):
+            lines.append(f'{name:<26} {value:>12.3f}'.rstrip('0').rstrip('.'))
+        text = '\n'.join(lines)[:1990]
+        await interaction.response.send_message(f'```\n{text}\n```', ephemeral=True)
+
 async def setup(bot):
     await bot.add_cog(BotSettings(bot))
@@ -0,0 +1,69 @@
+import asyncio
+import multiprocessing
+import os
+import time
+import aiohttp
+import bot as anonbot
+
+CLUSTER_PROCESSES = os.cpu_count() or 1
+IDENTIFY_DELAY = 5  # seconds between cluster starts, Discord allows one identify per 5 seconds
+
+async def _recommended_shard_count(token):
+    async with aiohttp.ClientSession() as session:
+        async with session.get('https://discord.com/api/v10/gateway/bot', headers={'Authorization': f'Bot {token}'}) as resp:
+            resp.raise_for_status()
+            data = await resp.json()
+    return data['shards']
+
+def _shard_ranges(shard_count, processes):
+    processes = max(1, min(processes, shard_count))
+    size, extra = divmod(shard_count, processes)
+    ranges = []
+    start = 0
+    for i in range(processes):
+        end = start + size + (1 if i < extra else 0)
+        ranges.append(list(range(start, end)))
+        start = end
+    return ranges
+
+def _run_cluster(cluster_id, shard_ids, shard_count, image_workers):
+    client = anonbot.create_bot(sharded=True, shard_ids=shard_ids, shard_count=shard_count, cluster_id=cluster_id,
+                                image_workers=image_workers)
+    client.run(anonbot.TOKEN)
+
+def _start(context, cluster_id, shard_ids, shard_count, image_workers):
+    process = context.Process(target=_run_cluster, args=(cluster_id, shard_ids, shard_count, image_workers), name=f'anonpost-cluster-{cluster_id}')
+    process.start()
+    print(f'Cluster {cluster_id} started with shards {shard_ids[0]}-{shard_ids[-1]} (pid {process.pid})')
+    return process
+
+def main():
+    if not anonbot.TOKEN:
+        raise ValueError("No or improper token provided")
+    shard_count = anonbot.SHARD_COUNT or asyncio.run(_recommended_shard_count(anonbot.TOKEN))
+    ranges = _shard_ranges(shard_count, CLUSTER_PROCESSES)
+    context = multiprocessing.get_context('spawn')
+    # every cluster runs its own image pool; together they should not exceed the CPUs
+    image_workers = max(1, (os.cpu_count() or 1) // len(ranges))
+
+    # every cluster opens the same SQLite file; WAL mode lets them share it safely
+    processes = {}
+    for cluster_id, shard_ids in enumerate(ranges):
+        processes[cluster_id] = _start(context, cluster_id, shard_ids, shard_count, image_workers)
+        time.sleep(IDENTIFY_DELAY)
+
+    try:
+        while True:
+            time.sleep(IDENTIFY_DELAY)
+            for cluster_id, process in list(processes.items()):
+                if not process.is_alive():
+                    print(f'Cluster {cluster_id} exited with code {process.exitcode}, restarting')
+                    processes[cluster_id] = _start(context, cluster_id, ranges[cluster_id], shard_count, image_workers)
+    except KeyboardInterrupt:
+        for process in processes.values():
+            process.terminate()
+        for process in processes.values():
+            process.join()
+
+if __name__ == '__main__':
+    main()
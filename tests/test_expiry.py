@@ -0,0 +1,44 @@
+import unittest
+from utils.expiry import ExpiryQueue
+from utils.ratelimit import RateLimiter
+
+
+class ExpiryQueueTest(unittest.TestCase):
+    def test_pop_due_returns_only_live_due_keys(self):
+        queue = ExpiryQueue(lambda keys: None, clock=lambda: 0)
+        queue.set('a', 5)
+        queue.set('b', 10)
+        queue.set('a', 20)  # rescheduled; the old heap entry is stale
+        queue.set('c', 1)
+        queue.discard('c')
+        self.assertEqual(queue.pop_due(10), ['b'])
+        self.assertEqual(queue.pop_due(20), ['a'])
+        self.assertEqual(len(queue), 0)
+
+    def test_equal_deadlines_with_keys_of_different_types(self):
+        queue = ExpiryQueue(lambda keys: None, clock=lambda: 0)
+        queue.set((1, 5), 2)
+        queue.set(1, 2)
+        queue.set('x', 2)
+        self.assertCountEqual(queue.pop_due(2), [(1, 5), 1, 'x'])
+
+    def test_compaction_keeps_mixed_keys_working(self):
+        queue = ExpiryQueue(lambda keys: None, clock=lambda: 0)
+        for _ in range(100):
+            queue.set((1, 5), 2)
+            queue.set(1, 2)
+        self.assertCountEqual(queue.pop_due(2), [(1, 5), 1])
+
+
+class RateLimiterTest(unittest.TestCase):
+    def test_user_and_channel_buckets_expiring_together(self):
+        # a user cooldown of 2s and a 30 per minute channel limit both refill at t=2
+        limiter = RateLimiter(clock=lambda: 100.0)
+        self.assertEqual(limiter.consume((1, 5), 1, 2), 0)
+        self.assertEqual(limiter.consume(1, 30, 60), 0)
+        self.assertEqual(limiter.retry_after((1, 5), 1, 2), 2)
+        self.assertEqual(limiter.retry_after(1, 30, 60), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import unittest
+from utils.channels import ChannelSettings
+from utils.floodgate import FloodGate, fingerprint
+
+COPYPASTA = 'join our server now for free nitro, the giveaway ends tonight so click the link ' * 3
+
+
+class FloodGateTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.gate = FloodGate(clock=lambda: self.now)
+        self.settings = ChannelSettings(1, flood_limit=3, flood_window=600)
+
+    def test_rejects_copies_over_the_limit(self):
+        self.assertEqual([self.gate.admit(self.settings, COPYPASTA) for _ in range(4)], [True, True, True, False])
+
+    def test_rejects_near_duplicates(self):
+        for i in range(3):
+            self.assertTrue(self.gate.admit(self.settings, COPYPASTA + f'#{i}'))
+        self.assertFalse(self.gate.admit(self.settings, COPYPASTA.upper() + ' please'))
+
+    def test_window_expires(self):
+        for _ in range(3):
+            self.gate.admit(self.settings, COPYPASTA)
+        self.now += 601
+        self.assertTrue(self.gate.admit(self.settings, COPYPASTA))
+
+    def test_short_and_wordless_bodies_are_not_fingerprinted(self):
+        self.assertEqual(fingerprint('👍'), (None, None))
+        self.assertEqual(fingerprint('!!!'), (None, None))
+        for body in ['👍', '😂', '!!!', '>>', '🔥🔥', 'lol', 'lol', 'lol', 'lol', 'this']:
+            self.assertTrue(self.gate.admit(self.settings, body))
+        self.assertEqual(len(self.gate), 0)
+
+    def test_same_image_from_different_urls(self):
+        for i in range(3):
+            self.assertTrue(self.gate.admit(self.settings, image_url=f'https://example.com/{i}.png'))
+            self.assertTrue(self.gate.admit(self.settings, digest='abc'))
+        self.assertFalse(self.gate.admit(self.settings, digest='abc'))
+        self.assertTrue(self.gate.admit(self.settings, image_url='https://example.com/0.png'))
+        self.assertTrue(self.gate.admit(self.settings, image_url='https://example.com/0.png'))
+        self.assertFalse(self.gate.admit(self.settings, image_url='https://example.com/0.png'))
+
+    def test_channels_and_disabled_limit_are_independent(self):
+        for _ in range(3):
+            self.gate.admit(self.settings, COPYPASTA)
+        self.assertTrue(self.gate.admit(ChannelSettings(2, flood_limit=3), COPYPASTA))
+        self.assertTrue(self.gate.admit(ChannelSettings(1, flood_limit=0), COPYPASTA))
+
+    def test_memory_is_bounded(self):
+        gate = FloodGate(max_entries=50, clock=lambda: self.now)
+        for i in range(200):
+            gate.admit(self.settings, f'unique post number {i} with enough words', digest=str(i))
+        self.assertEqual(len(gate), 50)
+        self.now += 601
+        gate.prune()
+        self.assertEqual(len(gate), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
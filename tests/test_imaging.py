@@ -0,0 +1,62 @@
+import asyncio
+import os
+import unittest
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from PIL import Image
+from utils.imaging import ImageError, ImageProcessor, normalize
+
+
+def _animation(fmt):
+    frames = [Image.new('RGB', (320, 240), color) for color in ('red', 'green', 'blue')]
+    exif = Image.Exif()
+    exif[0x010f] = 'Camera maker'
+    exif[0x8825] = {1: 'N', 2: (51.0, 30.0, 0.0)}  # GPS
+    out = BytesIO()
+    frames[0].save(out, fmt, save_all=True, append_images=frames[1:], duration=100, loop=0, exif=exif.tobytes())
+    return out.getvalue()
+
+
+class NormalizeTest(unittest.TestCase):
+    def _check_animation(self, fmt, extension):
+        data = _animation(fmt)
+        self.assertTrue(Image.open(BytesIO(data)).getexif())
+        encoded, ext = normalize(data, 2048, 4 * 1024 * 1024)
+        self.assertEqual(ext, extension)
+        img = Image.open(BytesIO(encoded))
+        self.assertTrue(img.is_animated)
+        self.assertEqual(img.n_frames, 3)
+        self.assertEqual(dict(img.getexif()), {})
+        self.assertNotIn('exif', img.info)
+
+    def test_animated_webp_loses_exif(self):
+        self._check_animation('WEBP', 'webp')
+
+    def test_animated_png_loses_exif(self):
+        self._check_animation('PNG', 'png')
+
+    def test_animation_is_shrunk_to_fit(self):
+        encoded, _ = normalize(_animation('WEBP'), 100, 4 * 1024 * 1024)
+        self.assertLessEqual(max(Image.open(BytesIO(encoded)).size), 100)
+
+
+class ImageProcessorTest(unittest.IsolatedAsyncioTestCase):
+    async def test_broken_pool_is_replaced(self):
+        processor = ImageProcessor(workers=1)
+        processor.start()
+        try:
+            broken = processor._pool
+            # kill the only worker; the executor then rejects every job
+            with self.assertRaises(BrokenProcessPool):
+                await asyncio.wrap_future(broken.submit(os._exit, 1))
+            with self.assertRaises(ImageError):
+                await processor.normalize(_animation('WEBP'))
+            self.assertIsNot(processor._pool, broken)
+            encoded, _ = await processor.normalize(_animation('WEBP'))
+            self.assertTrue(encoded)
+        finally:
+            await processor.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
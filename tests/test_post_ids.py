@@ -0,0 +1,45 @@
+import random
+import unittest
+from utils.post_ids import ALPHABET, ID_LENGTH, ID_SPACE, PostIdCodec
+
+
+class PostIdCodecTest(unittest.TestCase):
+    def setUp(self):
+        self.codec = PostIdCodec(b'0123456789abcdef')
+
+    def test_round_trip(self):
+        numbers = list(range(2000)) + random.Random(1).sample(range(ID_SPACE), 2000) + [ID_SPACE - 1]
+        ids = [self.codec.encode(number) for number in numbers]
+        self.assertEqual(len(set(ids)), len(numbers))
+        for number, post_id in zip(numbers, ids):
+            self.assertEqual(len(post_id), ID_LENGTH)
+            self.assertTrue(set(post_id) <= set(ALPHABET))
+            self.assertEqual(self.codec.decode(post_id), number)
+
+    def test_round_trip_through_cycle_walking(self):
+        # numbers whose first permutation lands outside ID_SPACE need more than one step
+        walked = [number for number in range(5000) if self.codec._permute(number) >= ID_SPACE]
+        self.assertTrue(walked)
+        for number in walked:
+            post_id = self.codec.encode(number)
+            self.assertEqual(len(post_id), ID_LENGTH)
+            self.assertEqual(self.codec.decode(post_id), number)
+
+    def test_out_of_range(self):
+        with self.assertRaises(ValueError):
+            self.codec.encode(ID_SPACE)
+        with self.assertRaises(ValueError):
+            self.codec.encode(-1)
+
+    def test_decode_rejects_malformed_ids(self):
+        for text in ('ABC', 'ABCDEFGH', 'abcdefg', 'ABC-EFG'):
+            with self.assertRaises(ValueError):
+                self.codec.decode(text)
+
+    def test_other_key_gives_other_ids(self):
+        other = PostIdCodec(b'fedcba9876543210')
+        self.assertNotEqual([self.codec.encode(n) for n in range(10)], [other.encode(n) for n in range(10)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from utils.sequences import BlockAllocator
+from utils.storage import Storage
+
+
+class BlockAllocatorTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.storage = Storage(os.path.join(self.tmp.name, 'test.db'))
+        await self.storage.start()
+        self.sequences = BlockAllocator(self.storage, block_size=10)
+        await self.sequences.load()
+
+    async def asyncTearDown(self):
+        await self.storage.close()
+        self.tmp.cleanup()
+
+    async def _reserved(self, name):
+        row = await self.storage.fetchone("SELECT reserved FROM sequences WHERE name = ?", (name,))
+        return row[0] if row else None
+
+    async def test_allocators_never_hand_out_the_same_number(self):
+        # two allocators on one database stand in for two cluster processes
+        other = BlockAllocator(self.storage, block_size=10)
+        numbers = await asyncio.gather(*(allocator.next('post') for _ in range(45) for allocator in (self.sequences, other)))
+        self.assertEqual(len(set(numbers)), 90)
+        self.assertGreaterEqual(await self._reserved('post'), max(numbers))
+
+    async def test_sequences_are_independent_and_start_after_seed(self):
+        self.assertEqual(await self.sequences.next('post:1', start=100), 101)
+        self.assertEqual(await self.sequences.next('post:2'), 1)
+        # start only applies when the sequence is first created
+        self.assertEqual(await self.sequences.next('post:1', start=0), 102)
+
+    async def test_release_rolls_back_an_untouched_reservation(self):
+        for _ in range(3):
+            await self.sequences.next('post')
+        await self.sequences.release()
+        self.assertEqual(await self._reserved('post'), 3)
+        self.assertEqual(await BlockAllocator(self.storage, block_size=10).next('post'), 4)
+
+    async def test_release_keeps_a_reservation_extended_by_someone_else(self):
+        await self.sequences.next('post')
+        other = BlockAllocator(self.storage, block_size=10)
+        self.assertEqual(await other.next('post'), 11)
+        await self.sequences.release()
+        self.assertEqual(await self._reserved('post'), 20)
+
+    async def test_restart_after_a_crash_continues_above_the_reservation(self):
+        first = [await self.sequences.next('post') for _ in range(3)]
+        # no release(): the process died with most of its block unused
+        restarted = BlockAllocator(self.storage, block_size=10)
+        number = await restarted.next('post')
+        self.assertGreater(number, 10)
+        self.assertNotIn(number, first)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import os
+import tempfile
+import unittest
+from utils.channels import ChannelRegistry
+from utils.state_version import StateVersion
+from utils.storage import Storage
+
+
+class StateVersionTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.storage = Storage(os.path.join(self.tmp.name, 'test.db'))
+        await self.storage.start()
+        # two instances on one database stand in for two cluster processes
+        self.ours = StateVersion(self.storage)
+        self.theirs = StateVersion(self.storage)
+        await self.ours.load()
+        await self.theirs.load()
+
+    async def asyncTearDown(self):
+        await self.storage.close()
+        self.tmp.cleanup()
+
+    async def test_only_other_writers_count_as_changes(self):
+        await self.ours.bump()
+        self.assertFalse(await self.ours.changed())
+        self.assertTrue(await self.theirs.changed())
+        self.assertFalse(await self.theirs.changed())
+
+    async def test_channel_writes_bump_the_version(self):
+        channels = ChannelRegistry(self.storage, self.ours)
+        await channels.load()
+        await channels.add(1)
+        await channels.update(1, cooldown=5)
+        await channels.remove(1)
+        self.assertEqual(await self.ours.read(), 3)
+        self.assertTrue(await self.theirs.changed())
+
+    async def test_unrelated_writes_do_not_count(self):
+        await self.storage.execute('CREATE TABLE items (id INTEGER PRIMARY KEY)')
+        await self.storage.execute('INSERT INTO items DEFAULT VALUES')
+        self.assertFalse(await self.theirs.changed())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import asyncio
+import os
+import sqlite3
+import tempfile
+import unittest
+from utils.storage import Storage
+
+
+class StorageTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'test.db')
+        self.storage = Storage(self.path, flush_interval=0.05)
+        await self.storage.start()
+        await self.storage.execute('CREATE TABLE items (id INTEGER PRIMARY KEY, value TEXT)')
+
+    async def asyncTearDown(self):
+        await self.storage.close()
+        self.tmp.cleanup()
+
+    def _committed(self):
+        # a separate connection only sees what has actually been committed
+        db = sqlite3.connect(self.path)
+        try:
+            return db.execute('SELECT count(*) FROM items').fetchone()[0]
+        finally:
+            db.close()
+
+    async def test_concurrent_writes_are_committed_when_they_resolve(self):
+        results = await asyncio.gather(*(self.storage.execute('INSERT INTO items (value) VALUES (?)', (str(i),)) for i in range(300)))
+        self.assertEqual(results, [1] * 300)
+        self.assertEqual(self._committed(), 300)
+
+    async def test_writes_are_grouped_into_one_transaction(self):
+        commits = []
+        self.storage._commit, commit = (lambda db, pending: (commits.append(len(pending)), commit(db, pending))), self.storage._commit
+        await asyncio.gather(*(self.storage.execute('INSERT INTO items (value) VALUES (?)', (str(i),)) for i in range(50)))
+        self.assertLess(len(commits), 50)
+        self.assertEqual(sum(commits), 50)
+
+    async def test_failed_statement_does_not_fail_the_batch(self):
+        await self.storage.execute('INSERT INTO items (id, value) VALUES (1, ?)', ('a',))
+        results = await asyncio.gather(
+            self.storage.execute('INSERT INTO items (id, value) VALUES (2, ?)', ('b',)),
+            self.storage.execute('INSERT INTO items (id, value) VALUES (1, ?)', ('duplicate',)),
+            self.storage.execute('INSERT INTO items (id, value) VALUES (3, ?)', ('c',)),
+            return_exceptions=True)
+        self.assertEqual(results[0], 1)
+        self.assertIsInstance(results[1], sqlite3.IntegrityError)
+        self.assertEqual(results[2], 1)
+        self.assertEqual(self._committed(), 3)
+
+    async def test_rolled_back_transaction_fails_pending_writes(self):
+        # a full database rolls back the whole transaction, not just the statement
+        await self.storage.run(lambda db: db.execute('PRAGMA max_page_count = {}'.format(
+            db.execute('PRAGMA page_count').fetchone()[0] + 1)))
+        small = self.storage.execute('INSERT INTO items (value) VALUES (?)', ('small',))
+        large = self.storage.execute('INSERT INTO items (value) VALUES (?)', ('x' * 100000,))
+        results = await asyncio.wait_for(asyncio.gather(small, large, return_exceptions=True), 5)
+        self.assertIsInstance(results[0], sqlite3.OperationalError)
+        self.assertIsInstance(results[1], sqlite3.OperationalError)
+        self.assertEqual(self._committed(), 0)
+        # the writer keeps working afterwards
+        self.assertEqual(await self.storage.execute('INSERT INTO items (value) VALUES (?)', ('after',)), 1)
+
+    async def test_reads_see_earlier_writes(self):
+        write = self.storage.execute('INSERT INTO items (value) VALUES (?)', ('a',))
+        read = self.storage.fetchone('SELECT value FROM items')
+        await write
+        self.assertEqual(await read, ('a',))
+
+    async def test_close_commits_pending_writes(self):
+        write = asyncio.ensure_future(self.storage.execute('INSERT INTO items (value) VALUES (?)', ('a',)))
+        await asyncio.sleep(0)
+        await self.storage.close()
+        self.assertEqual(await write, 1)
+        self.assertEqual(self._committed(), 1)
+        await self.storage.start()
+
+
+if __name__ == '__main__':
+    unittest.main()
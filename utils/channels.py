@@ -0,0 +1,114 @@
+import asyncio
+
+DEFAULT_COOLDOWN = 10
+DEFAULT_MAX_BODY = 4000
+DEFAULT_RATE_LIMIT = 30
+DEFAULT_FLOOD_LIMIT = 3
+DEFAULT_FLOOD_WINDOW = 600
+
+_COLUMNS = {
+    'cooldown': f'REAL NOT NULL DEFAULT {DEFAULT_COOLDOWN}',
+    'allow_images': 'INTEGER NOT NULL DEFAULT 1',
+    'max_body': f'INTEGER NOT NULL DEFAULT {DEFAULT_MAX_BODY}',
+    'rate_limit': f'INTEGER NOT NULL DEFAULT {DEFAULT_RATE_LIMIT}',
+    'flood_limit': f'INTEGER NOT NULL DEFAULT {DEFAULT_FLOOD_LIMIT}',
+    'flood_window': f'REAL NOT NULL DEFAULT {DEFAULT_FLOOD_WINDOW}',
+}
+
+
+class ChannelSettings:
+    __slots__ = ('channel_id', 'cooldown', 'allow_images', 'max_body', 'rate_limit', 'flood_limit', 'flood_window')
+
+    def __init__(self, channel_id, cooldown=DEFAULT_COOLDOWN, allow_images=True, max_body=DEFAULT_MAX_BODY,
+                 rate_limit=DEFAULT_RATE_LIMIT, flood_limit=DEFAULT_FLOOD_LIMIT, flood_window=DEFAULT_FLOOD_WINDOW):
+        self.channel_id = channel_id
+        self.cooldown = cooldown
+        self.allow_images = bool(allow_images)
+        self.max_body = max_body
+        self.rate_limit = rate_limit  # posts per minute across the whole channel, 0 for unlimited
+        self.flood_limit = flood_limit  # copies of the same text or image allowed per flood_window, 0 for unlimited
+        self.flood_window = flood_window
+
+
+class ChannelRegistry:
+    # In-memory mirror of anon_channels. Loaded once, then written through, so the
+    # post path never has to ask the database whether a channel is set up.
+    # Writes hold the lock only while changing the mirror and queueing the write,
+    # which keeps them ordered with reload(); the commit is awaited after release.
+    def __init__(self, storage, state_version=None):
+        self.storage = storage
+        self.state_version = state_version
+        self._channels = {}
+        self._lock = asyncio.Lock()
+
+    async def load(self):
+        await self.storage.execute("""
+        CREATE TABLE IF NOT EXISTS anon_channels (
+            channel_id INTEGER PRIMARY KEY
+        )
+        """)
+        existing = {row[1] for row in await self.storage.fetchall("PRAGMA table_info(anon_channels)")}
+        for column, definition in _COLUMNS.items():
+            if column not in existing:
+                await self.storage.execute(f"ALTER TABLE anon_channels ADD COLUMN {column} {definition}")
+        await self.reload()
+
+    async def reload(self):
+        # picks up changes made by other processes sharing the database
+        async with self._lock:
+            rows = await self.storage.fetchall("SELECT channel_id, cooldown, allow_images, max_body, rate_limit, flood_limit, flood_window FROM anon_channels")
+            self._channels = {row[0]: ChannelSettings(*row) for row in rows}
+
+    def __contains__(self, channel_id):
+        return channel_id in self._channels
+
+    def __len__(self):
+        return len(self._channels)
+
+    def get(self, channel_id):
+        return self._channels.get(channel_id)
+
+    def settings_for(self, channel_id):
+        return self._channels.get(channel_id) or ChannelSettings(channel_id)
+
+    def _write(self, sql, params):
+        write = self.storage.execute(sql, params)
+        if self.state_version is None:
+            return write
+        return asyncio.gather(write, self.state_version.bump())
+
+    async def add(self, channel_id):
+        settings = ChannelSettings(channel_id)
+        async with self._lock:
+            write = self._write("INSERT OR IGNORE INTO anon_channels (channel_id, cooldown, allow_images, max_body, rate_limit, flood_limit, flood_window) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                (channel_id, settings.cooldown, int(settings.allow_images), settings.max_body, settings.rate_limit,
+                                 settings.flood_limit, settings.flood_window))
+            settings = self._channels.setdefault(channel_id, settings)
+        await write
+        return settings
+
+    async def remove(self, channel_id):
+        async with self._lock:
+            self._channels.pop(channel_id, None)
+            write = self._write("DELETE FROM anon_channels WHERE channel_id = ?", (channel_id,))
+        await write
+
+    async def update(self, channel_id, cooldown=None, allow_images=None, max_body=None, rate_limit=None, flood_limit=None,
+                     flood_window=None):
+        async with self._lock:
+            current = self._channels[channel_id]
+            settings = ChannelSettings(
+                channel_id,
+                current.cooldown if cooldown is None else cooldown,
+                current.allow_images if allow_images is None else allow_images,
+                current.max_body if max_body is None else max_body,
+                current.rate_limit if rate_limit is None else rate_limit,
+                current.flood_limit if flood_limit is None else flood_limit,
+                current.flood_window if flood_window is None else flood_window,
+            )
+            write = self._write("UPDATE anon_channels SET cooldown = ?, allow_images = ?, max_body = ?, rate_limit = ?, flood_limit = ?, flood_window = ? WHERE channel_id = ?",
+                                (settings.cooldown, int(settings.allow_images), settings.max_body, settings.rate_limit,
+                                 settings.flood_limit, settings.flood_window, channel_id))
+            self._channels[channel_id] = settings
+        await write
+        return settings
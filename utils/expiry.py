@@ -0,0 +1,87 @@
+import asyncio
+import heapq
+import inspect
+import itertools
+import time
+
+
+class ExpiryQueue:
+    # Min-heap of (deadline, seq, key) swept by one background task. Everything that is
+    # due when the task wakes up is handed to on_expire as a single batch.
+    # Rescheduled or discarded keys leave stale heap entries behind; those are
+    # skipped on pop and compacted away once they outnumber the live ones.
+    def __init__(self, on_expire, clock=time.time, max_sleep=60):
+        self.on_expire = on_expire
+        self.clock = clock
+        self.max_sleep = max_sleep
+        self._deadlines = {}
+        self._heap = []
+        # breaks deadline ties so keys of different types are never compared
+        self._sequence = itertools.count()
+        self._wakeup = None
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def __contains__(self, key):
+        return key in self._deadlines
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def get(self, key):
+        return self._deadlines.get(key)
+
+    def set(self, key, deadline):
+        self._deadlines[key] = deadline
+        earliest = self._heap[0][0] if self._heap else None
+        heapq.heappush(self._heap, (deadline, next(self._sequence), key))
+        if self._wakeup is not None and (earliest is None or deadline < earliest):
+            self._wakeup.set()
+        if len(self._heap) > 2 * len(self._deadlines) + 64:
+            self._heap = [(deadline, next(self._sequence), key) for key, deadline in self._deadlines.items()]
+            heapq.heapify(self._heap)
+
+    def discard(self, key):
+        self._deadlines.pop(key, None)
+
+    def pop_due(self, now=None):
+        now = self.clock() if now is None else now
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            deadline, _, key = heapq.heappop(self._heap)
+            if self._deadlines.get(key) == deadline:
+                del self._deadlines[key]
+                due.append(key)
+        return due
+
+    async def _run(self):
+        while True:
+            due = self.pop_due()
+            if due:
+                try:
+                    result = self.on_expire(due)
+                    if inspect.isawaitable(result):
+                        await result
+                except Exception as e:
+                    print(f'Failed to expire {len(due)} entries: {e}')
+            self._wakeup.clear()
+            timeout = self.max_sleep
+            if self._heap:
+                timeout = min(timeout, max(0, self._heap[0][0] - self.clock()))
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
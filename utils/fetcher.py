@@ -0,0 +1,66 @@
+import asyncio
+from collections import namedtuple
+import aiohttp
+
+Fetched = namedtuple('Fetched', 'status data content_type headers')
+
+
+class FetchError(Exception):
+    pass
+
+
+class ImageFetcher:
+    # One pooled session for the lifetime of the cog. Downloads are streamed and
+    # abandoned as soon as they cross max_bytes, so a huge or slow URL can only
+    # hold one slot for at most the configured timeouts.
+    def __init__(self, max_bytes=8 * 1024 * 1024, max_concurrency=32, per_host=4,
+                 connect_timeout=5, read_timeout=10, total_timeout=20, chunk_size=64 * 1024):
+        self.max_bytes = max_bytes
+        self.max_concurrency = max_concurrency
+        self.per_host = per_host
+        self.chunk_size = chunk_size
+        self.timeout = aiohttp.ClientTimeout(total=total_timeout, sock_connect=connect_timeout, sock_read=read_timeout)
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._session = None
+
+    async def start(self):
+        if self._session is not None:
+            return
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency, limit_per_host=self.per_host,
+                                         ttl_dns_cache=300, enable_cleanup_closed=True)
+        self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def fetch(self, url, headers=None):
+        if self._session is None:
+            raise RuntimeError('ImageFetcher has not been started')
+        async with self._semaphore:
+            try:
+                async with self._session.get(url, headers=headers) as resp:
+                    if resp.status == 304:
+                        return Fetched(304, b'', resp.content_type, resp.headers.copy())
+                    if resp.status != 200:
+                        raise FetchError(f'image host returned HTTP {resp.status}')
+                    if resp.content_length is not None and resp.content_length > self.max_bytes:
+                        raise FetchError('image is too large')
+                    data = bytearray()
+                    async for chunk in resp.content.iter_chunked(self.chunk_size):
+                        data.extend(chunk)
+                        if len(data) > self.max_bytes:
+                            raise FetchError('image is too large')
+                    return Fetched(resp.status, bytes(data), resp.content_type, resp.headers.copy())
+            except asyncio.TimeoutError:
+                raise FetchError('image download timed out')
+            except (aiohttp.ClientError, ValueError) as e:
+                raise FetchError(f'could not download image ({e.__class__.__name__})')
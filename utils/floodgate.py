@@ -0,0 +1,160 @@
+import hashlib
+import re
+import time
+from collections import deque
+
+BANDS = 8
+BAND_BITS = 64 // BANDS
+_BAND_MASK = (1 << BAND_BITS) - 1
+
+_WORD = re.compile(r'\w+')
+
+
+class FloodError(Exception):
+    pass
+
+
+def _hash64(data):
+    return int.from_bytes(hashlib.blake2b(data.encode(), digest_size=8).digest(), 'big')
+
+
+def fingerprint(text, min_words=1):
+    # Exact hash of the text with case, punctuation and spacing taken out, and a
+    # 64-bit SimHash over its word 3-shingles. Repeated shingles count every time,
+    # so padding a copypasta with a few extra words barely moves the hash.
+    # Text with fewer than min_words words gets (None, None): "lol" or an emoji
+    # is not a copypasta, and without words every such post would hash the same.
+    words = _WORD.findall(text.casefold())
+    if len(words) < max(1, min_words):
+        return None, None
+    exact = _hash64(' '.join(words))
+    shingles = [' '.join(words[i:i + 3]) for i in range(max(1, len(words) - 2))]
+    # one 64-char bit string per shingle; zip(*) then counts each bit position in C
+    bits = {shingle: format(_hash64(shingle), '064b') for shingle in set(shingles)}
+    rows = [bits[shingle] for shingle in shingles]
+    half = len(rows) / 2
+    simhash = 0
+    for column in zip(*rows):
+        simhash = (simhash << 1) | (column.count('1') > half)
+    return exact, simhash
+
+
+def _bands(simhash):
+    return [(i, (simhash >> (i * BAND_BITS)) & _BAND_MASK) for i in range(BANDS)]
+
+
+class _Window:
+    __slots__ = ('entries', 'counts', 'bands', 'period')
+
+    def __init__(self):
+        self.period = 0
+        self.entries = deque()  # (time, keys, simhash) in arrival order
+        self.counts = {}
+        self.bands = {}
+
+    def add(self, now, keys, simhash):
+        self.entries.append((now, keys, simhash))
+        for key in keys:
+            self.counts[key] = self.counts.get(key, 0) + 1
+        if simhash is not None:
+            for band in _bands(simhash):
+                bucket = self.bands.setdefault(band, {})
+                bucket[simhash] = bucket.get(simhash, 0) + 1
+
+    def evict(self):
+        _, keys, simhash = self.entries.popleft()
+        for key in keys:
+            if self.counts[key] == 1:
+                del self.counts[key]
+            else:
+                self.counts[key] -= 1
+        if simhash is not None:
+            for band in _bands(simhash):
+                bucket = self.bands[band]
+                if bucket[simhash] == 1:
+                    del bucket[simhash]
+                    if not bucket:
+                        del self.bands[band]
+                else:
+                    bucket[simhash] -= 1
+
+    def expire(self, now):
+        while self.entries and self.entries[0][0] <= now - self.period:
+            self.evict()
+
+    def near(self, simhash, distance):
+        # any hash within `distance` bits shares at least one band with it, as long
+        # as distance < BANDS; only those candidates are compared bit by bit
+        seen = set()
+        total = 0
+        for band in _bands(simhash):
+            for other, count in self.bands.get(band, {}).items():
+                if other not in seen:
+                    seen.add(other)
+                    if bin(simhash ^ other).count('1') <= distance:
+                        total += count
+        return total
+
+
+class FloodGate:
+    # Rolling per-channel windows of what was recently posted: exact body hashes,
+    # SimHashes for near-duplicate bodies, image URLs and image content digests.
+    # Lookups are dictionary hits; memory is capped at max_entries per channel.
+    # Bodies shorter than min_words words are not fingerprinted at all.
+    def __init__(self, distance=7, max_entries=1000, min_words=4, clock=time.time):
+        if distance >= BANDS:
+            raise ValueError(f'distance must be below {BANDS}')
+        self.distance = distance
+        self.max_entries = max_entries
+        self.min_words = min_words
+        self.clock = clock
+        self._windows = {}
+
+    def __len__(self):
+        return sum(len(window.entries) for window in self._windows.values())
+
+    def _window(self, channel_id, period, now):
+        window = self._windows.get(channel_id)
+        if window is None:
+            window = self._windows[channel_id] = _Window()
+        window.period = period
+        window.expire(now)
+        return window
+
+    def admit(self, settings, text=None, image_url=None, digest=None):
+        # Records the submission and returns True, or returns False without
+        # recording it when the channel already holds flood_limit copies.
+        limit, period = settings.flood_limit, settings.flood_window
+        if limit <= 0:
+            return True
+        now = self.clock()
+        window = self._window(settings.channel_id, period, now)
+        keys = []
+        simhash = None
+        if text is not None:
+            exact, simhash = fingerprint(text, self.min_words)
+            if exact is not None:
+                keys.append(('text', exact))
+        if image_url:
+            keys.append(('url', _hash64(image_url.strip())))
+        if digest is not None:
+            keys.append(('image', digest))
+        if not keys:
+            return True
+        if any(window.counts.get(key, 0) >= limit for key in keys):
+            return False
+        if simhash is not None and window.near(simhash, self.distance) >= limit:
+            return False
+        window.add(now, tuple(keys), simhash)
+        if len(window.entries) > self.max_entries:
+            window.evict()
+        return True
+
+    def prune(self):
+        # drops windows that have gone quiet; the post path only trims the channel it touches
+        now = self.clock()
+        for channel_id in list(self._windows):
+            window = self._windows[channel_id]
+            window.expire(now)
+            if not window.entries:
+                del self._windows[channel_id]
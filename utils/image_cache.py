@@ -0,0 +1,241 @@
+import asyncio
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+import time
+from collections import OrderedDict, namedtuple
+from utils.metrics import metrics
+
+CachedImage = namedtuple('CachedImage', 'data content_type digest')
+
+_MAX_AGE = re.compile(r'max-age=(\d+)')
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class _UrlEntry:
+    __slots__ = ('digest', 'content_type', 'etag', 'last_modified', 'expires')
+
+    def __init__(self, digest, content_type, etag, last_modified, expires):
+        self.digest = digest
+        self.content_type = content_type
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expires = expires
+
+
+class _BlobTier:
+    # Byte-budgeted LRU of digest -> size; the bytes live in memory or on disk.
+    def __init__(self, budget):
+        self.budget = budget
+        self.used = 0
+        self.sizes = OrderedDict()
+
+    def touch(self, digest):
+        if digest in self.sizes:
+            self.sizes.move_to_end(digest)
+            return True
+        return False
+
+    def add(self, digest, size):
+        if digest in self.sizes:
+            self.sizes.move_to_end(digest)
+            return []
+        self.sizes[digest] = size
+        self.used += size
+        evicted = []
+        while self.used > self.budget and len(self.sizes) > 1:
+            old, old_size = self.sizes.popitem(last=False)
+            self.used -= old_size
+            evicted.append(old)
+        return evicted
+
+    def discard(self, digest):
+        size = self.sizes.pop(digest, None)
+        if size is not None:
+            self.used -= size
+
+
+class ImageCache:
+    # URLs map to content hashes, and content hashes map to bytes, so the same
+    # image posted from different URLs is stored once. Stale URLs are revalidated
+    # with ETag / Last-Modified instead of being downloaded again.
+    # The disk tier is process-local: the URL index only lives in memory, so each
+    # process writes into its own private directory under disk_path and removes
+    # it on close. Nothing on disk outlives the process that can reach it.
+    def __init__(self, fetcher, memory_bytes=64 * 1024 * 1024, disk_path=None, disk_bytes=512 * 1024 * 1024,
+                 max_urls=10000, default_ttl=300, max_ttl=86400):
+        self.fetcher = fetcher
+        self.disk_path = disk_path
+        self.max_urls = max_urls
+        self.default_ttl = default_ttl
+        self.max_ttl = max_ttl
+        self._urls = OrderedDict()
+        self._memory = _BlobTier(memory_bytes)
+        self._blobs = {}
+        self._disk = _BlobTier(disk_bytes) if disk_path else None
+        self._disk_dir = None
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.evictions = 0
+
+    async def start(self):
+        if self._disk is None or self._disk_dir is not None:
+            return
+        self._disk_dir = await asyncio.to_thread(self._open_disk)
+
+    async def close(self):
+        if self._disk_dir is None:
+            return
+        await asyncio.to_thread(shutil.rmtree, self._disk_dir, True)
+        self._disk_dir = None
+        self._disk = _BlobTier(self._disk.budget)
+
+    def _open_disk(self):
+        os.makedirs(self.disk_path, exist_ok=True)
+        # directories left behind by processes that died without closing are unreachable
+        for entry in os.scandir(self.disk_path):
+            pid = entry.name.partition('-')[0]
+            if entry.is_dir() and pid.isdigit() and not _alive(int(pid)):
+                shutil.rmtree(entry.path, ignore_errors=True)
+            elif entry.is_file() and len(entry.name) == 64:
+                # blobs from before the tier was process-local
+                os.remove(entry.path)
+        # mkdtemp creates the directory 0700; the blobs are raw downloads, metadata included
+        return tempfile.mkdtemp(prefix=f'{os.getpid()}-', dir=self.disk_path)
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'revalidations': self.revalidations,
+            'evictions': self.evictions,
+            'urls': len(self._urls),
+            'memory_bytes': self._memory.used,
+            'disk_bytes': self._disk.used if self._disk else 0,
+        }
+
+    async def get(self, url):
+        # concurrent requests for the same URL share one download
+        task = self._inflight.get(url)
+        if task is None:
+            task = asyncio.ensure_future(self._get(url))
+            self._inflight[url] = task
+            task.add_done_callback(lambda _: self._inflight.pop(url, None))
+        return await asyncio.shield(task)
+
+    async def _get(self, url):
+        entry = self._urls.get(url)
+        data = None
+        if entry is not None:
+            self._urls.move_to_end(url)
+            data = await self._load(entry.digest)
+            if data is None:
+                del self._urls[url]
+                entry = None
+            elif entry.expires > time.time():
+                self.hits += 1
+                return CachedImage(data, entry.content_type, entry.digest)
+
+        headers = {}
+        if entry is not None:
+            if entry.etag:
+                headers['If-None-Match'] = entry.etag
+            if entry.last_modified:
+                headers['If-Modified-Since'] = entry.last_modified
+        with metrics.timed('image_fetch'):
+            fetched = await self.fetcher.fetch(url, headers=headers or None)
+
+        if fetched.status == 304 and entry is not None:
+            self.hits += 1
+            self.revalidations += 1
+            entry.expires = self._expires(fetched.headers)
+            return CachedImage(data, entry.content_type, entry.digest)
+
+        self.misses += 1
+        digest = hashlib.sha256(fetched.data).hexdigest()
+        if 'no-store' not in fetched.headers.get('Cache-Control', ''):
+            await self._store(digest, fetched.data)
+            self._urls[url] = _UrlEntry(digest, fetched.content_type, fetched.headers.get('ETag'),
+                                        fetched.headers.get('Last-Modified'), self._expires(fetched.headers))
+            self._urls.move_to_end(url)
+            while len(self._urls) > self.max_urls:
+                self._urls.popitem(last=False)
+        return CachedImage(fetched.data, fetched.content_type, digest)
+
+    def _expires(self, headers):
+        cache_control = headers.get('Cache-Control', '')
+        if 'no-cache' in cache_control:
+            return 0
+        match = _MAX_AGE.search(cache_control)
+        ttl = int(match.group(1)) if match else self.default_ttl
+        return time.time() + min(ttl, self.max_ttl)
+
+    async def _load(self, digest):
+        if self._memory.touch(digest):
+            return self._blobs[digest]
+        if self._disk_dir is not None and self._disk.touch(digest):
+            try:
+                data = await asyncio.to_thread(self._read_disk, self._disk_dir, digest)
+            except OSError:
+                self._disk.discard(digest)
+                return None
+            self._remember(digest, data)
+            return data
+        return None
+
+    async def _store(self, digest, data):
+        self._remember(digest, data)
+        if self._disk_dir is not None and digest not in self._disk.sizes:
+            directory = self._disk_dir
+            try:
+                await asyncio.to_thread(self._write_disk, directory, digest, data)
+            except OSError:
+                return
+            if directory != self._disk_dir:
+                return  # closed while writing
+            for old in self._disk.add(digest, len(data)):
+                self.evictions += 1
+                await asyncio.to_thread(self._remove_disk, directory, old)
+
+    def _remember(self, digest, data):
+        if digest in self._blobs:
+            self._memory.touch(digest)
+            return
+        self._blobs[digest] = data
+        for old in self._memory.add(digest, len(data)):
+            self.evictions += 1
+            del self._blobs[old]
+
+    def _read_disk(self, directory, digest):
+        with open(os.path.join(directory, digest), 'rb') as f:
+            return f.read()
+
+    def _write_disk(self, directory, digest, data):
+        path = os.path.join(directory, digest)
+        tmp = f'{path}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def _remove_disk(self, directory, digest):
+        try:
+            os.remove(os.path.join(directory, digest))
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,205 @@
+import asyncio
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+
+try:
+    from PIL import Image, ImageOps, ImageSequence
+except ImportError:
+    Image = None
+
+_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'\xff\xd8\xff', 'jpeg'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+)
+
+_EXTENSIONS = {'png': 'png', 'jpeg': 'jpg', 'gif': 'gif', 'webp': 'webp'}
+
+MAX_PIXELS = 64_000_000
+MAX_ANIMATION_PIXELS = 32_000_000  # summed over all frames after resizing
+
+
+class ImageError(Exception):
+    pass
+
+
+def sniff_format(data):
+    for signature, fmt in _SIGNATURES:
+        if data.startswith(signature):
+            return fmt
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+
+def _has_alpha(img):
+    return img.mode in ('RGBA', 'LA', 'PA') or (img.mode == 'P' and 'transparency' in img.info)
+
+
+def _encode(img, fmt, quality):
+    out = BytesIO()
+    if fmt == 'jpeg':
+        img.save(out, 'JPEG', quality=quality, optimize=True, progressive=True)
+    elif fmt == 'webp':
+        img.save(out, 'WEBP', quality=quality, method=4)
+    else:
+        img.save(out, 'PNG', optimize=True)
+    return out.getvalue()
+
+
+def _frames(img, dimension):
+    # Fresh RGBA copies of every frame with no info dict, so EXIF, XMP, ICC
+    # profiles and comments are not carried over into the re-encoded file.
+    frames, durations = [], []
+    for frame in ImageSequence.Iterator(img):
+        durations.append(frame.info.get('duration', 100))
+        frame = frame.convert('RGBA')
+        frame.thumbnail((dimension, dimension))
+        frame.info = {}
+        frames.append(frame)
+    return frames, durations
+
+
+def _encode_animation(frames, durations, loop, fmt):
+    out = BytesIO()
+    options = {'save_all': True, 'append_images': frames[1:], 'duration': durations}
+    if loop is not None:
+        options['loop'] = loop
+    if fmt == 'webp':
+        frames[0].save(out, 'WEBP', quality=80, method=4, **options)
+    elif fmt == 'gif':
+        frames[0].save(out, 'GIF', optimize=True, disposal=2, **options)
+    else:
+        frames[0].save(out, 'PNG', **options)
+    return out.getvalue()
+
+
+def _normalize_animation(img, fmt, max_dimension, max_bytes):
+    # keep the animation, but cap the decoded size of all frames together
+    budget = int((MAX_ANIMATION_PIXELS / img.n_frames) ** 0.5)
+    dimension = min(max_dimension, budget)
+    if dimension < 64:
+        raise ImageError('animated image has too many frames')
+    loop = img.info.get('loop')
+    while True:
+        frames, durations = _frames(img, dimension)
+        encoded = _encode_animation(frames, durations, loop, fmt)
+        if len(encoded) <= max_bytes:
+            return encoded
+        dimension //= 2
+        if dimension < 64:
+            raise ImageError('animated image is too large')
+
+
+def normalize(data, max_dimension, max_bytes):
+    # Runs in a worker process: decode, drop metadata, shrink and re-encode.
+    fmt = sniff_format(data)
+    if fmt is None:
+        raise ImageError('URL does not point to a supported image')
+
+    Image.MAX_IMAGE_PIXELS = MAX_PIXELS
+    try:
+        img = Image.open(BytesIO(data))
+        if getattr(img, 'is_animated', False):
+            return _normalize_animation(img, fmt, max_dimension, max_bytes), _EXTENSIONS[fmt]
+        img.draft('RGB', (max_dimension, max_dimension))
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((max_dimension, max_dimension))
+        if _has_alpha(img):
+            img = img.convert('RGBA')
+            out_fmt = 'png'
+        else:
+            img = img.convert('RGB')
+            out_fmt = 'jpeg'
+
+        quality = 85
+        encoded = _encode(img, out_fmt, quality)
+        while len(encoded) > max_bytes:
+            if out_fmt == 'png':
+                out_fmt = 'webp'
+            elif quality > 50:
+                quality -= 15
+            else:
+                img.thumbnail((img.width // 2, img.height // 2))
+                if img.width < 64 or img.height < 64:
+                    raise ImageError('image is too large')
+            encoded = _encode(img, out_fmt, quality)
+    except ImageError:
+        raise
+    except (OSError, ValueError, Image.DecompressionBombError):
+        raise ImageError('image could not be decoded')
+    return encoded, _EXTENSIONS[out_fmt]
+
+
+class ImageProcessor:
+    # Normalized results are kept by content digest under a byte budget, so a
+    # reposted image is not decoded and re-encoded again.
+    def __init__(self, max_dimension=2048, max_bytes=4 * 1024 * 1024, workers=None, cache_bytes=32 * 1024 * 1024):
+        if Image is None:
+            # without Pillow, EXIF/GPS metadata would be posted as-is on an anonymous board
+            raise RuntimeError('Pillow is required to post images; install it with pip install Pillow')
+        self.max_dimension = max_dimension
+        self.max_bytes = max_bytes
+        self.workers = workers
+        self.cache_bytes = cache_bytes
+        self._pool = None
+        self._cache = OrderedDict()
+        self._cache_used = 0
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+
+    def start(self):
+        if self._pool is None:
+            # spawn keeps the storage thread and sockets out of the workers
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+
+    async def close(self):
+        if self._pool is not None:
+            pool, self._pool = self._pool, None
+            await asyncio.to_thread(pool.shutdown, cancel_futures=True)
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    async def normalize(self, data, digest=None):
+        if digest is None:
+            return await self._normalize(data)
+        result = self._cache.get(digest)
+        if result is not None:
+            self._cache.move_to_end(digest)
+            self.hits += 1
+            return result
+        self.misses += 1
+        task = self._inflight.get(digest)
+        if task is None:
+            task = asyncio.ensure_future(self._normalize(data, digest))
+            self._inflight[digest] = task
+            task.add_done_callback(lambda _: self._inflight.pop(digest, None))
+        return await asyncio.shield(task)
+
+    async def _normalize(self, data, digest=None):
+        loop = asyncio.get_running_loop()
+        pool = self._pool
+        try:
+            result = await loop.run_in_executor(pool, normalize, data, self.max_dimension, self.max_bytes)
+        except BrokenProcessPool:
+            # a worker died (out of memory, a crash in a decoder); the executor
+            # refuses all further work, so swap in a fresh one
+            if self._pool is pool:
+                self._pool = None
+                pool.shutdown(wait=False, cancel_futures=True)
+                self.start()
+            raise ImageError('image could not be processed')
+        if digest is not None and len(result[0]) <= self.cache_bytes:
+            self._cache[digest] = result
+            self._cache_used += len(result[0])
+            while self._cache_used > self.cache_bytes:
+                _, (old, _) = self._cache.popitem(last=False)
+                self._cache_used -= len(old)
+        return result
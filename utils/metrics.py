@@ -0,0 +1,135 @@
+import asyncio
+import functools
+import random
+import time
+from contextlib import contextmanager
+from aiohttp import web
+
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    __slots__ = ('counts', 'count', 'total')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value):
+        i = 0
+        while i < len(BUCKETS) and value > BUCKETS[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.total += value
+
+    def quantile(self, q):
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if seen + n >= rank and n:
+                lower = BUCKETS[i - 1] if i else 0.0
+                upper = BUCKETS[i] if i < len(BUCKETS) else BUCKETS[-1]
+                return lower + (upper - lower) * (rank - seen) / n
+            seen += n
+        return BUCKETS[-1]
+
+
+class Metrics:
+    # Process-wide counters, stage latency histograms and callback gauges. Latencies
+    # are only recorded for a sample_rate fraction of calls; counters are exact.
+    def __init__(self, sample_rate=1.0):
+        self.sample_rate = sample_rate
+        self.counters = {}
+        self.stages = {}
+        self.gauges = {}
+        self.last_loop_lag = 0.0
+
+    def inc(self, event, n=1):
+        self.counters[event] = self.counters.get(event, 0) + n
+
+    def observe(self, stage, seconds):
+        histogram = self.stages.get(stage)
+        if histogram is None:
+            histogram = self.stages[stage] = Histogram()
+        histogram.observe(seconds)
+
+    def sampled(self):
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    @contextmanager
+    def timed(self, stage):
+        if not self.sampled():
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def measure(self, stage):
+        def decorator(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                with self.timed(stage):
+                    return await func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def gauge(self, name, fn):
+        self.gauges[name] = fn
+
+    def read_gauges(self):
+        values = {}
+        for name, fn in self.gauges.items():
+            try:
+                values[name] = float(fn())
+            except Exception:
+                continue
+        return values
+
+    def render_prometheus(self):
+        lines = ['# TYPE anonpost_events_total counter']
+        for event, value in sorted(self.counters.items()):
+            lines.append(f'anonpost_events_total{{event="{event}"}} {value}')
+        lines.append('# TYPE anonpost_stage_seconds histogram')
+        for stage, histogram in sorted(self.stages.items()):
+            cumulative = 0
+            for bound, n in zip(BUCKETS, histogram.counts):
+                cumulative += n
+                lines.append(f'anonpost_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'anonpost_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram.count}')
+            lines.append(f'anonpost_stage_seconds_sum{{stage="{stage}"}} {histogram.total}')
+            lines.append(f'anonpost_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+        for name, value in sorted(self.read_gauges().items()):
+            lines.append(f'# TYPE anonpost_{name} gauge')
+            lines.append(f'anonpost_{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+    async def watch_loop_lag(self, interval=0.5):
+        # how late the loop wakes us up is how long something else held it
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(interval)
+            lag = max(0.0, loop.time() - start - interval)
+            self.observe('loop_lag', lag)
+            self.last_loop_lag = lag
+
+    async def serve(self, port, host='127.0.0.1'):
+        async def handle(request):
+            return web.Response(text=self.render_prometheus(), content_type='text/plain', charset='utf-8')
+
+        app = web.Application()
+        app.router.add_get('/metrics', handle)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        return runner
+
+
+metrics = Metrics()
@@ -0,0 +1,131 @@
+import asyncio
+import itertools
+import time
+import discord
+from utils.metrics import metrics
+
+ROOT_POST = 0
+REPLY = 1
+
+
+class _ChannelQueue:
+    __slots__ = ('queue', 'worker', 'tokens', 'updated', 'blocked_until')
+
+    def __init__(self, capacity):
+        self.queue = asyncio.PriorityQueue()
+        self.worker = None
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+
+class OutboundScheduler:
+    # One priority queue and worker per destination channel. Each worker paces its
+    # sends with a local bucket matching Discord's per-channel message limit, so
+    # handlers wait in our queue instead of inside the library's 429 retry sleeps.
+    # Threads have their own limit and so their own queue; root posts only overtake
+    # replies where both go to the same channel, i.e. thread creation.
+    def __init__(self, rate=5, per=5.0, idle_timeout=30):
+        self.rate = rate
+        self.per = per
+        self.idle_timeout = idle_timeout
+        self._channels = {}
+        self._sequence = itertools.count()
+        self.sent = 0
+        self.failed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def depth(self, channel_id=None):
+        if channel_id is not None:
+            channel = self._channels.get(channel_id)
+            return channel.queue.qsize() if channel else 0
+        return sum(channel.queue.qsize() for channel in self._channels.values())
+
+    def stats(self):
+        completed = self.sent + self.failed
+        return {
+            'channels': len(self._channels),
+            'depth': self.depth(),
+            'sent': self.sent,
+            'failed': self.failed,
+            'avg_wait': self.total_wait / completed if completed else 0.0,
+            'max_wait': self.max_wait,
+        }
+
+    async def submit(self, channel_id, priority, send):
+        # send is a zero-argument callable returning the coroutine that does the request
+        channel = self._channels.get(channel_id)
+        if channel is None:
+            channel = self._channels[channel_id] = _ChannelQueue(self.rate)
+        if channel.worker is None:
+            channel.worker = asyncio.create_task(self._work(channel_id, channel))
+        future = asyncio.get_running_loop().create_future()
+        channel.queue.put_nowait((priority, next(self._sequence), time.monotonic(), send, future))
+        return await future
+
+    async def close(self):
+        channels, self._channels = self._channels, {}
+        for channel in channels.values():
+            if channel.worker is not None:
+                channel.worker.cancel()
+            while not channel.queue.empty():
+                future = channel.queue.get_nowait()[4]
+                if not future.done():
+                    future.set_exception(RuntimeError('Outbound scheduler was closed'))
+        await asyncio.gather(*(c.worker for c in channels.values() if c.worker is not None), return_exceptions=True)
+
+    def _delay(self, channel):
+        now = time.monotonic()
+        channel.tokens = min(self.rate, channel.tokens + (now - channel.updated) * self.rate / self.per)
+        channel.updated = now
+        delay = max(0.0, channel.blocked_until - now)
+        if channel.tokens < 1:
+            delay = max(delay, (1 - channel.tokens) * self.per / self.rate)
+        return delay
+
+    async def _work(self, channel_id, channel):
+        while True:
+            try:
+                item = await asyncio.wait_for(channel.queue.get(), self.idle_timeout)
+            except asyncio.TimeoutError:
+                if channel.queue.empty():
+                    channel.worker = None
+                    if self._channels.get(channel_id) is channel:
+                        del self._channels[channel_id]
+                    return
+                continue
+            _, _, enqueued, send, future = item
+            if future.done():
+                continue
+
+            delay = self._delay(channel)
+            while delay > 0:
+                await asyncio.sleep(delay)
+                delay = self._delay(channel)
+            channel.tokens -= 1
+
+            wait = time.monotonic() - enqueued
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            metrics.observe('send_queue_wait', wait)
+            try:
+                with metrics.timed('discord_send'):
+                    result = await send()
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+            except discord.RateLimited as e:
+                # a long 429 the library handed back to us: pause the channel and retry in order
+                channel.blocked_until = time.monotonic() + e.retry_after
+                metrics.inc('send_rate_limited')
+                channel.queue.put_nowait(item)
+                continue
+            except Exception as e:
+                self.failed += 1
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                self.sent += 1
+                if not future.done():
+                    future.set_result(result)
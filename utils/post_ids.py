@@ -0,0 +1,93 @@
+import hashlib
+import secrets
+import string
+
+ALPHABET = string.ascii_uppercase + string.digits
+ID_LENGTH = 7
+ID_SPACE = len(ALPHABET) ** ID_LENGTH
+
+_HALF_BITS = 19
+_HALF_MASK = (1 << _HALF_BITS) - 1
+_ROUNDS = 4
+
+
+class PostIdCodec:
+    # Keyed Feistel permutation of [0, 36**7). Sequence numbers go in, IDs that look
+    # random come out, and two different numbers can never share an ID. IDs are one
+    # character longer than the old random ones so they cannot clash with those either.
+    def __init__(self, key):
+        self._round_keys = [hashlib.blake2b(key, digest_size=16, person=b'anonpost%d' % i).digest() for i in range(_ROUNDS)]
+
+    def _round(self, i, value):
+        digest = hashlib.blake2b(value.to_bytes(3, 'big'), digest_size=4, key=self._round_keys[i]).digest()
+        return int.from_bytes(digest, 'big') & _HALF_MASK
+
+    def _permute(self, value):
+        left, right = value >> _HALF_BITS, value & _HALF_MASK
+        for i in range(_ROUNDS):
+            left, right = right, left ^ self._round(i, right)
+        return (left << _HALF_BITS) | right
+
+    def _unpermute(self, value):
+        left, right = value >> _HALF_BITS, value & _HALF_MASK
+        for i in reversed(range(_ROUNDS)):
+            left, right = right ^ self._round(i, left), left
+        return (left << _HALF_BITS) | right
+
+    def encode(self, number):
+        if not 0 <= number < ID_SPACE:
+            raise ValueError('post ID space exhausted')
+        # cycle-walk: the permutation covers 2**38 values, keep going until we land inside ID_SPACE
+        value = self._permute(number)
+        while value >= ID_SPACE:
+            value = self._permute(value)
+        chars = []
+        for _ in range(ID_LENGTH):
+            value, digit = divmod(value, len(ALPHABET))
+            chars.append(ALPHABET[digit])
+        return ''.join(reversed(chars))
+
+    def decode(self, post_id):
+        if len(post_id) != ID_LENGTH:
+            raise ValueError('not a sequential post ID')
+        value = 0
+        for char in post_id:
+            value = value * len(ALPHABET) + ALPHABET.index(char)
+        value = self._unpermute(value)
+        while value >= ID_SPACE:
+            value = self._unpermute(value)
+        return value
+
+
+class PostIdAllocator:
+    def __init__(self, storage, sequences):
+        self.storage = storage
+        self.sequences = sequences
+        self.codec = None
+
+    async def load(self):
+        await self.storage.execute("""
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value
+        )
+        """)
+        await self.storage.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('post_id_key', ?)", (secrets.token_hex(16),))
+        key, = await self.storage.fetchone("SELECT value FROM meta WHERE key = 'post_id_key'")
+        self.codec = PostIdCodec(bytes.fromhex(key))
+
+    async def next(self):
+        return self.codec.encode(await self.sequences.next('post_id'))
+
+    def parse(self, text):
+        # Normalizes user input to post ID form, or returns None. This is only a
+        # length and alphabet check: every 7-character string decodes to some
+        # number, so a result does not mean the ID was ever handed out.
+        post_id = text.strip().upper()
+        if len(post_id) == ID_LENGTH - 1 and all(char in ALPHABET for char in post_id):
+            return post_id  # random IDs from before sequential allocation
+        try:
+            self.codec.decode(post_id)
+        except ValueError:
+            return None
+        return post_id
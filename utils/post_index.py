@@ -0,0 +1,146 @@
+import asyncio
+import re
+import time
+from collections import deque, namedtuple
+from utils.metrics import metrics
+
+SearchResult = namedtuple('SearchResult', 'post_id post_number is_reply channel_id message_id title snippet created_at')
+
+_TOKEN = re.compile(r'(\w+)(\*?)')
+
+
+def build_query(text):
+    # Every word is quoted so FTS5 operators and column filters in user input are
+    # matched as plain text; a trailing * keeps working as a prefix search.
+    return ' '.join(f'"{word}"{star}' for word, star in _TOKEN.findall(text))
+
+
+class PostIndex:
+    # Full-text index of posts and replies. The post path only appends to an
+    # in-memory buffer; a background task writes it out in batches, so indexing
+    # never adds a database round trip to sending a post.
+    def __init__(self, storage, flush_interval=1.0, batch_size=500, max_pending=20000):
+        self.storage = storage
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self._pending = deque()
+        self._wakeup = None
+        self._task = None
+
+    async def load(self):
+        await self.storage.execute("""
+        CREATE TABLE IF NOT EXISTS post_index (
+            id INTEGER PRIMARY KEY,
+            post_id TEXT NOT NULL,
+            post_number INTEGER,
+            is_reply INTEGER NOT NULL DEFAULT 0,
+            guild_id INTEGER,
+            channel_id INTEGER,
+            message_id INTEGER,
+            title TEXT NOT NULL DEFAULT '',
+            body TEXT NOT NULL DEFAULT '',
+            created_at REAL NOT NULL
+        )
+        """)
+        await self.storage.execute("CREATE INDEX IF NOT EXISTS post_index_post_id ON post_index (post_id)")
+        await self.storage.execute("CREATE INDEX IF NOT EXISTS post_index_created_at ON post_index (created_at)")
+        # external content table: the text lives once in post_index, FTS5 only keeps the inverted index
+        await self.storage.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS post_index_fts USING fts5(
+            title, body, content='post_index', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+        )
+        """)
+        await self.storage.execute("""
+        CREATE TRIGGER IF NOT EXISTS post_index_ai AFTER INSERT ON post_index BEGIN
+            INSERT INTO post_index_fts (rowid, title, body) VALUES (new.id, new.title, new.body);
+        END
+        """)
+        await self.storage.execute("""
+        CREATE TRIGGER IF NOT EXISTS post_index_ad AFTER DELETE ON post_index BEGIN
+            INSERT INTO post_index_fts (post_index_fts, rowid, title, body) VALUES ('delete', old.id, old.title, old.body);
+        END
+        """)
+
+    def start(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, post_id, post_number, guild_id, channel_id, message_id, body, title='', is_reply=False):
+        if len(self._pending) >= self.max_pending:
+            # the database is not keeping up; losing search entries beats growing without bound
+            self._pending.popleft()
+            metrics.inc('post_index_dropped')
+        self._pending.append((post_id, post_number, int(is_reply), guild_id, channel_id, message_id, title, body, time.time()))
+        if len(self._pending) >= self.batch_size and self._wakeup is not None:
+            self._wakeup.set()
+
+    async def flush(self):
+        while self._pending:
+            batch = [self._pending.popleft() for _ in range(min(self.batch_size, len(self._pending)))]
+            await self.storage.executemany("""
+            INSERT INTO post_index (post_id, post_number, is_reply, guild_id, channel_id, message_id, title, body, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, batch)
+
+    async def search(self, guild_id, text, limit=10):
+        query = build_query(text)
+        if not query:
+            return []
+        with metrics.timed('post_search'):
+            rows = await self.storage.fetchall("""
+            SELECT p.post_id, p.post_number, p.is_reply, p.channel_id, p.message_id, p.title,
+                   snippet(post_index_fts, 1, '**', '**', '…', 16), p.created_at
+            FROM post_index_fts JOIN post_index p ON p.id = post_index_fts.rowid
+            WHERE post_index_fts MATCH ? AND p.guild_id = ?
+            ORDER BY bm25(post_index_fts, 2.0, 1.0)
+            LIMIT ?
+            """, (query, guild_id, limit))
+        return [SearchResult(*row) for row in rows]
+
+    async def lookup(self, guild_id, post_id):
+        # the post itself, or None, and how many of its replies are indexed
+        rows = await self.storage.fetchall("""
+        SELECT post_id, post_number, is_reply, channel_id, message_id, title, substr(body, 1, 200), created_at
+        FROM post_index WHERE post_id = ? AND guild_id = ?
+        ORDER BY is_reply, id
+        """, (post_id, guild_id))
+        if not rows:
+            return None, 0
+        post = SearchResult(*rows[0]) if not rows[0][2] else None
+        return post, len(rows) - (post is not None)
+
+    async def prune(self, cutoff):
+        deleted = 0
+        while True:
+            count = await self.storage.execute(
+                "DELETE FROM post_index WHERE id IN (SELECT id FROM post_index WHERE created_at < ? LIMIT 1000)", (cutoff,))
+            deleted += count
+            if count < 1000:
+                return deleted
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f'Failed to write the post index: {e}')
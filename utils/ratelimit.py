@@ -0,0 +1,59 @@
+import time
+from utils.expiry import ExpiryQueue
+
+
+class _Bucket:
+    __slots__ = ('tokens', 'updated')
+
+    def __init__(self, tokens, updated):
+        self.tokens = tokens
+        self.updated = updated
+
+
+class RateLimiter:
+    # Token buckets keyed by anything hashable. A bucket is only kept while it is
+    # below capacity; once it would have refilled it is dropped by the expiry
+    # queue, which is indistinguishable from a fresh full bucket.
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self._buckets = {}
+        self._expiry = ExpiryQueue(self._drop, clock=clock)
+
+    def start(self):
+        self._expiry.start()
+
+    async def close(self):
+        await self._expiry.close()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def _drop(self, keys):
+        for key in keys:
+            self._buckets.pop(key, None)
+
+    def _refill(self, key, capacity, per, now):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            return capacity
+        return min(capacity, bucket.tokens + (now - bucket.updated) * capacity / per)
+
+    def retry_after(self, key, capacity, per):
+        if capacity <= 0 or per <= 0:
+            return 0
+        tokens = self._refill(key, capacity, per, self.clock())
+        if tokens >= 1:
+            return 0
+        return (1 - tokens) * per / capacity
+
+    def consume(self, key, capacity, per):
+        if capacity <= 0 or per <= 0:
+            return 0
+        now = self.clock()
+        tokens = self._refill(key, capacity, per, now)
+        if tokens < 1:
+            return (1 - tokens) * per / capacity
+        tokens -= 1
+        self._buckets[key] = _Bucket(tokens, now)
+        self._expiry.set(key, now + (capacity - tokens) * per / capacity)
+        return 0
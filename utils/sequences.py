@@ -0,0 +1,51 @@
+import asyncio
+
+
+class BlockAllocator:
+    # Hi/lo numbering. Each sequence durably reserves a block of numbers in one
+    # write and then hands them out from memory. A crash can only skip the unused
+    # part of a block, never repeat a number; a clean shutdown gives it back.
+    def __init__(self, storage, block_size=50):
+        self.storage = storage
+        self.block_size = block_size
+        self._blocks = {}
+        self._locks = {}
+
+    async def load(self):
+        await self.storage.execute("""
+        CREATE TABLE IF NOT EXISTS sequences (
+            name TEXT PRIMARY KEY,
+            reserved INTEGER NOT NULL
+        )
+        """)
+
+    async def next(self, name, start=0):
+        block = self._blocks.get(name)
+        if block is None or block[0] >= block[1]:
+            lock = self._locks.setdefault(name, asyncio.Lock())
+            async with lock:
+                block = self._blocks.get(name)
+                if block is None or block[0] >= block[1]:
+                    block = await self._reserve(name, start)
+        number = block[0]
+        block[0] += 1
+        return number
+
+    async def _reserve(self, name, start):
+        size = self.block_size
+
+        def reserve(db):
+            db.execute("INSERT OR IGNORE INTO sequences (name, reserved) VALUES (?, ?)", (name, start))
+            return db.execute("UPDATE sequences SET reserved = reserved + ? WHERE name = ? RETURNING reserved", (size, name)).fetchone()[0]
+
+        reserved = await self.storage.run(reserve)
+        block = [reserved - size + 1, reserved + 1]
+        self._blocks[name] = block
+        return block
+
+    async def release(self):
+        # Only rolls back a reservation nobody else has extended in the meantime.
+        unused = [(first - 1, name, limit - 1) for name, (first, limit) in self._blocks.items() if first < limit]
+        self._blocks.clear()
+        if unused:
+            await self.storage.executemany("UPDATE sequences SET reserved = ? WHERE name = ? AND reserved = ?", unused)
@@ -0,0 +1,42 @@
+class StateVersion:
+    # A counter in meta that every write to state mirrored in memory (bans,
+    # channel settings) bumps. Cluster processes poll it and only reload when it
+    # moved past the last value they know about, including their own bumps.
+    def __init__(self, storage):
+        self.storage = storage
+        self.seen = None
+
+    async def load(self):
+        await self.storage.execute("""
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value
+        )
+        """)
+        await self.storage.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('state_version', 0)")
+        self.seen = await self.read()
+
+    async def read(self):
+        value, = await self.storage.fetchone("SELECT value FROM meta WHERE key = 'state_version'")
+        return value
+
+    def bump(self):
+        # queued behind the caller's write, so whoever sees the new value also sees the write
+        future = self.storage.run(lambda db: db.execute(
+            "UPDATE meta SET value = value + 1 WHERE key = 'state_version' RETURNING value").fetchone()[0])
+        future.add_done_callback(self._bumped)
+        return future
+
+    def _bumped(self, future):
+        if future.cancelled() or future.exception() is not None:
+            return
+        # our own change is already in memory; anything else in between still needs a reload
+        if self.seen is not None and future.result() == self.seen + 1:
+            self.seen = future.result()
+
+    async def changed(self):
+        value = await self.read()
+        if value == self.seen:
+            return False
+        self.seen = value
+        return True
@@ -0,0 +1,155 @@
+import asyncio
+import queue
+import sqlite3
+import threading
+import time
+from utils.metrics import metrics
+
+_STOP = object()
+
+
+def _resolve(future, result, error):
+    if future.cancelled():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+class Storage:
+    # SQLite runs on one writer thread. Writes from many callers are grouped into
+    # a single transaction and their futures resolve only once that transaction
+    # has been committed, so awaiting a write still means it is on disk.
+    # The query methods enqueue as soon as they are called and return a future,
+    # so jobs run in call order even if the caller awaits them later.
+    def __init__(self, path, flush_interval=0.01, max_batch=500):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._thread = None
+        self._loop = None
+
+    async def start(self):
+        if self._thread is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        ready = self._loop.create_future()
+        self._thread = threading.Thread(target=self._run, args=(ready,), name='anonpost-storage', daemon=True)
+        self._thread.start()
+        await ready
+
+    async def close(self):
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        await asyncio.to_thread(self._thread.join)
+        self._thread = None
+
+    def _submit(self, fn, write):
+        if self._thread is None:
+            raise RuntimeError('Storage has not been started')
+        future = self._loop.create_future()
+        if metrics.sampled():
+            stage = 'storage_write' if write else 'storage_read'
+            start = time.perf_counter()
+            future.add_done_callback(lambda _: metrics.observe(stage, time.perf_counter() - start))
+        self._queue.put((fn, future, write))
+        return future
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def execute(self, sql, params=()):
+        return self._submit(lambda db: db.execute(sql, params).rowcount, True)
+
+    def executemany(self, sql, seq_of_params):
+        return self._submit(lambda db: db.executemany(sql, seq_of_params).rowcount, True)
+
+    def run(self, fn):
+        # fn(db) runs inside the current write batch; use it for read-modify-write work.
+        return self._submit(fn, True)
+
+    def fetchone(self, sql, params=()):
+        return self._submit(lambda db: db.execute(sql, params).fetchone(), False)
+
+    def fetchall(self, sql, params=()):
+        return self._submit(lambda db: db.execute(sql, params).fetchall(), False)
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=FULL')
+        db.execute('PRAGMA busy_timeout=5000')
+        return db
+
+    def _notify(self, future, result=None, error=None):
+        self._loop.call_soon_threadsafe(_resolve, future, result, error)
+
+    def _run(self, ready):
+        try:
+            db = self._connect()
+        except Exception as e:
+            self._notify(ready, error=e)
+            return
+        self._notify(ready)
+
+        pending = []
+        deadline = None
+        stopping = False
+        while True:
+            if db.in_transaction:
+                timeout = deadline - time.monotonic()
+                try:
+                    job = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    job = None
+            else:
+                job = self._queue.get()
+
+            if job is _STOP:
+                stopping = True
+            elif job is not None:
+                fn, future, write = job
+                try:
+                    if write and not db.in_transaction:
+                        db.execute('BEGIN IMMEDIATE')
+                        deadline = time.monotonic() + self.flush_interval
+                    result = fn(db)
+                except Exception as e:
+                    # Most errors only roll back the failed statement and the rest of the
+                    # batch survives, but some (disk full, I/O errors, ...) make SQLite
+                    # roll back the whole transaction, taking the pending writes with it.
+                    self._notify(future, error=e)
+                    if pending and not db.in_transaction:
+                        for pending_future, _ in pending:
+                            self._notify(pending_future, error=e)
+                        pending = []
+                else:
+                    if write:
+                        pending.append((future, result))
+                    else:
+                        self._notify(future, result)
+
+            if db.in_transaction and (job is None or stopping or len(pending) >= self.max_batch
+                            or time.monotonic() >= deadline):
+                self._commit(db, pending)
+                pending = []
+            if stopping:
+                break
+        db.close()
+
+    def _commit(self, db, pending):
+        try:
+            db.execute('COMMIT')
+        except Exception as e:
+            try:
+                db.execute('ROLLBACK')
+            except sqlite3.Error:
+                pass
+            for future, _ in pending:
+                self._notify(future, error=e)
+            return
+        for future, result in pending:
+            self._notify(future, result)